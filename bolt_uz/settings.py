@@ -14,6 +14,8 @@ import os
 # import django_heroku
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
     'oauth2_provider',
     'social_django',
     'corsheaders',
+    'django_celery_beat',
 
     'user_auth',
     'coupons'
@@ -173,15 +176,81 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-FILE_UPLOAD_MAX_MEMORY_SIZE = 1024
-
 CELERY_BROKER_URL = f'redis://:{os.getenv("REDIS_PASSWORD")}@{os.getenv("REDIS_HOST")}:' \
                     f'{os.getenv("REDIS_PORT")}/{os.getenv("REDIS_DB_CELERY_BROKER")}'
 CELERY_RESULT_BACKEND = f'redis://:{os.getenv("REDIS_PASSWORD")}@{os.getenv("REDIS_HOST")}:' \
                         f'{os.getenv("REDIS_PORT")}/{os.getenv("REDIS_DB_CELERY_RESULT")}'
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'redis://{os.getenv("REDIS_HOST")}:{os.getenv("REDIS_PORT")}/{os.getenv("REDIS_DB_CACHE", default=2)}',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'PASSWORD': os.getenv('REDIS_PASSWORD'),
+            'IGNORE_EXCEPTIONS': True,
+        },
+    }
+}
+
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_WORKER_SEND_TASK_EVENTS = os.getenv('CELERY_WORKER_SEND_TASK_EVENTS', default=True) == 'True'
 CELERY_TASK_SEND_SENT_EVENT = os.getenv('CELERY_TASK_SEND_SENT_EVENT', default=True) == 'True'
+# CPU-bound OCR, network-bound distance resolution and light bookkeeping are consumed by separate workers.
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+CELERY_TASK_ROUTES = {
+    'coupons.tasks.read_ticket_words': {'queue': 'ocr'},
+    'coupons.tasks.image_batch_recognition': {'queue': 'ocr'},
+    'coupons.tasks.resolve_ticket_distances': {'queue': 'distance'},
+    'coupons.tasks.pdf_station_recognition': {'queue': 'distance'},
+}
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-coupons': {
+        'task': 'coupons.tasks.purge_expired_coupons',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'dispatch-tickets': {
+        'task': 'coupons.tasks.dispatch_tickets',
+        'schedule': crontab(),
+        'kwargs': {'restore': True},
+    },
+}
+
+OCR_LANGUAGES = os.getenv('OCR_LANGUAGES', default='uk').split(',')
+OCR_MAX_CONCURRENT_INFERENCES = int(os.getenv('OCR_MAX_CONCURRENT_INFERENCES', default=1))
+OCR_BATCH_MODE = os.getenv('OCR_BATCH_MODE', default='False') == 'True'
+OCR_BATCH_SIZE = int(os.getenv('OCR_BATCH_SIZE', default=8))
+OCR_BATCH_TIMEOUT_MS = int(os.getenv('OCR_BATCH_TIMEOUT_MS', default=500))
+OCR_BATCH_LEASE = int(os.getenv('OCR_BATCH_LEASE', default=60 * 10))
+OCR_MAX_IMAGE_SIDE = int(os.getenv('OCR_MAX_IMAGE_SIDE', default=1600))
+OCR_DETECTION_IMAGE_SIDE = int(os.getenv('OCR_DETECTION_IMAGE_SIDE', default=960))
+OCR_ENGINE_VERSION = os.getenv('OCR_ENGINE_VERSION', default='1')
+PDF_ENGINE_VERSION = os.getenv('PDF_ENGINE_VERSION', default='1')
+RECOGNITION_RESULT_CACHE_TTL = int(os.getenv('RECOGNITION_RESULT_CACHE_TTL', default=60 * 60 * 24 * 7))
+# Different e-tickets of the same layout may differ in only a few bits of perceptual hash.
+TICKET_PERCEPTUAL_DEDUP = os.getenv('TICKET_PERCEPTUAL_DEDUP', default='False') == 'True'
+TICKET_PERCEPTUAL_MAX_DISTANCE = int(os.getenv('TICKET_PERCEPTUAL_MAX_DISTANCE', default=12))
+TICKET_MAX_IN_FLIGHT_PER_USER = int(os.getenv('TICKET_MAX_IN_FLIGHT_PER_USER', default=20))
+TICKET_SCHEDULER_WINDOW = int(os.getenv('TICKET_SCHEDULER_WINDOW', default=32))
+TICKET_SCHEDULER_DEFAULT_WEIGHT = int(os.getenv('TICKET_SCHEDULER_DEFAULT_WEIGHT', default=1))
+TICKET_SCHEDULER_SLOT_TTL = int(os.getenv('TICKET_SCHEDULER_SLOT_TTL', default=60 * 60))
+
+ROUTE_DISTANCE_CACHE_SIZE = int(os.getenv('ROUTE_DISTANCE_CACHE_SIZE', default=4096))
+ROUTE_DISTANCE_CACHE_TTL = int(os.getenv('ROUTE_DISTANCE_CACHE_TTL', default=60 * 60 * 24 * 30))
+ROUTE_DISTANCE_NEGATIVE_CACHE_TTL = int(os.getenv('ROUTE_DISTANCE_NEGATIVE_CACHE_TTL', default=60 * 60 * 24))
+
+STATION_GRAPH_PATH = os.path.join(BASE_DIR, 'coupons', 'data', 'stations.json')
+# Segment lengths of bundled graph are approximate, enable only with data checked against official tariff distances.
+STATION_GRAPH_DISTANCES = os.getenv('STATION_GRAPH_DISTANCES', default='False') == 'True'
+STATION_MATCH_MIN_CONFIDENCE = float(os.getenv('STATION_MATCH_MIN_CONFIDENCE', default=0.5))
+STATION_MATCH_MAX_EDIT_RATIO = float(os.getenv('STATION_MATCH_MAX_EDIT_RATIO', default=0.2))
+STATION_MATCH_REJECT_UNKNOWN = os.getenv('STATION_MATCH_REJECT_UNKNOWN', default='True') == 'True'
+DISTANCE_RESOLUTION_WORKERS = int(os.getenv('DISTANCE_RESOLUTION_WORKERS', default=8))
+GOOGLE_MAPS_MAX_CONCURRENT_REQUESTS = int(os.getenv('GOOGLE_MAPS_MAX_CONCURRENT_REQUESTS', default=16))
+
+COUPON_LOW_STOCK_THRESHOLD = int(os.getenv('COUPON_LOW_STOCK_THRESHOLD', default=50))
+COUPON_IMPORT_CHUNK_SIZE = int(os.getenv('COUPON_IMPORT_CHUNK_SIZE', default=1000))
+COUPON_PURGE_BATCH_SIZE = int(os.getenv('COUPON_PURGE_BATCH_SIZE', default=1000))
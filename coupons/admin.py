@@ -1,13 +1,13 @@
 from django.conf.urls import url
 from django.contrib import admin
-from django.db.utils import IntegrityError
-from django.http import HttpRequest, HttpResponse
-from django.shortcuts import render
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, render
 
+from .constants import COUPON_IMPORT_HEADERS
 from .forms import FileImportForm
-from .logger import ExcelLogger
-from .models import Coupon, Ticket
-from .services import ExcelParserService
+from .models import Coupon, CouponImportJob, Ticket
+from .services import CouponImportJobService, CouponInventoryService
+from .tasks import import_coupons
 
 
 class CouponAdmin(admin.ModelAdmin):
@@ -16,37 +16,43 @@ class CouponAdmin(admin.ModelAdmin):
     search_fields = ('name', 'user__username', 'user__email')
     date_hierarchy = 'expiration_date'
     change_list_template = 'admin/coupons/coupon_change_list.html'
-    MAPPING = {
-        'Промокод': 'name',
-        'Ціна': 'price',
-        'Відстань': 'distance',
-        'Дата завершення': 'expiration_date'
-    }
+    MAPPING = COUPON_IMPORT_HEADERS
 
     def upload_excel(self, request: HttpRequest) -> HttpResponse:
         if request.method == 'POST':
             form = FileImportForm(request.POST, request.FILES)
             if form.is_valid():
-                logger = ExcelLogger()
-                excel_file = form.cleaned_data.get('excel_file')
-                parser = ExcelParserService(excel_file, self.MAPPING, logger)
-                data_in_dict = parser.to_dict(sheet_index=0)
-                
-                for coupon in data_in_dict:
-                    try:
-                        Coupon.objects.update_or_create(**coupon)
-                    except IntegrityError as e:
-                        logger.add_info(f'Купон {coupon.get("name", None)} вже існує.')
-
-                return render(request, 'admin/coupons/upload_coupons.html', context={"errors": logger.errors, "info": logger.info})
+                job = CouponImportJob.objects.create(file=form.cleaned_data.get('excel_file'), user=request.user)
+                import_coupons.apply_async(kwargs={'job_id': job.id})
+
+                return render(request, 'admin/coupons/upload_coupons.html', context={"job": job})
         
         form = FileImportForm()
         return render(request, 'admin/coupons/upload_coupons.html', context={"form": form})
+
+    def import_job_status(self, request: HttpRequest, job_id: int) -> HttpResponse:
+        job = get_object_or_404(CouponImportJob, id=job_id)
+        return JsonResponse(CouponImportJobService(job).get_status())
     
+    def changelist_view(self, request: HttpRequest, extra_context: dict = None) -> HttpResponse:
+        extra_context = {**(extra_context or {}), 'inventory': CouponInventoryService.get_inventory()}
+        return super().changelist_view(request, extra_context=extra_context)
+
     def get_urls(self):
         urls = super().get_urls()
-        my_urls = [url(r"^upload_excel/$", self.upload_excel, name='upload_excel')]
+        my_urls = [
+            url(r"^upload_excel/$", self.admin_site.admin_view(self.upload_excel), name='upload_excel'),
+            url(r"^import_jobs/(?P<job_id>\d+)/$", self.admin_site.admin_view(self.import_job_status),
+                name='coupon_import_job_status'),
+        ]
         return my_urls + urls
 
+
+class CouponImportJobAdmin(admin.ModelAdmin):
+    list_display = ('file', 'status', 'rows_processed', 'inserted', 'updated', 'duplicates', 'user', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'rows_processed', 'inserted', 'updated', 'duplicates', 'errors', 'info', 'finished_at')
+
 admin.site.register(Coupon, CouponAdmin)
+admin.site.register(CouponImportJob, CouponImportJobAdmin)
 admin.site.register(Ticket)
@@ -7,3 +7,10 @@ DEPARTURE = 'відправлення'
 APPOINTMENT = 'призначення'
 
 IMAGE_EXTENTSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
+
+COUPON_IMPORT_HEADERS = {
+    'Промокод': 'name',
+    'Ціна': 'price',
+    'Відстань': 'distance',
+    'Дата завершення': 'expiration_date'
+}
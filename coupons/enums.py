@@ -15,3 +15,14 @@ class ImageStationRecognitionErrors(Enum):
     EMPTY_IMAGE = 'The image is empty.'
     DEPARTMENT_OR_APPOINTMENT_NOT_FOUD = 'The image does not contain departure or appointment.'
     TICKET_ALREADY_USED = 'Ticket already used.'
+
+
+class DistanceErrors(Enum):
+    """Enum describes error messages for distance calculation service."""
+    STATION_NOT_RECOGNISED = 'The station is not recognised.'
+    ROUTE_NOT_FOUND = 'The route is not found.'
+
+
+class TicketSchedulerErrors(Enum):
+    """Enum describes error messages for ticket scheduler."""
+    TOO_MANY_TICKETS_IN_PROGRESS = 'Too many tickets are processing. Try again later.'
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from coupons.constants import DISTANCE_INDEX, PRICE_AND_DISTANCE
+from coupons.models import Ticket
+from coupons.services import CouponService
+
+
+class Command(BaseCommand):
+    help = 'Show query plans of hot coupon and ticket queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='Run queries with EXPLAIN ANALYZE')
+
+    def handle(self, *args, **options):
+        queries = {
+            'Available coupon by distance': CouponService.get_tier_coupons(
+                CouponService.get_claimable_coupons(), PRICE_AND_DISTANCE[0][DISTANCE_INDEX], 1
+            ),
+            'Ticket duplicate check': Ticket.objects.filter(origin='', destination='', unique_number=''),
+            'User ticket history': Ticket.objects.filter(user_id=0).order_by('-created_at')[:20],
+            'Pending image tickets': Ticket.objects.filter(status=Ticket.Status.PENDING).order_by('created_at')[:8],
+        }
+
+        # Coupon claim locks rows, so it can be explained in transaction only.
+        with transaction.atomic():
+            for name, queryset in queries.items():
+                self.stdout.write(self.style.SUCCESS(name))
+                self.stdout.write(queryset.explain(analyze=options['analyze']))
+                self.stdout.write('')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from coupons.services import TicketScheduler
+from user_auth.models import BoltUser
+
+
+class Command(BaseCommand):
+    help = 'Set count of tickets user takes per turn of ticket scheduler'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of user')
+        parser.add_argument('weight', nargs='?', type=int, help='Tickets per turn, default weight is restored if omitted')
+
+    def handle(self, *args, **options):
+        user = BoltUser.objects.filter(email=options['email']).first()
+        if user is None:
+            raise CommandError(f'User "{options["email"]}" does not exist')
+
+        weight = options['weight']
+        if weight is not None and weight < 1:
+            raise CommandError('Weight must be a positive number')
+
+        TicketScheduler.set_weight(user.id, weight)
+        self.stdout.write(self.style.SUCCESS(
+            f'Weight of user "{user.email}" is set to {TicketScheduler.get_weight(user.id)}'
+        ))
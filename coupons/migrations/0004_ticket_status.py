@@ -0,0 +1,24 @@
+# Generated by Django 3.2.19 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0003_auto_20230822_0757'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done')], default='done', max_length=10, verbose_name='Status'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done')], default='pending', max_length=10, verbose_name='Status'),
+        ),
+    ]
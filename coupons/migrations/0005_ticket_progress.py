@@ -0,0 +1,33 @@
+# Generated by Django 3.2.19 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0004_ticket_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='error',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Error'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='pages_count',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Pages count'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='pages_processed',
+            field=models.PositiveIntegerField(default=0, verbose_name='Pages processed'),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status'),
+        ),
+    ]
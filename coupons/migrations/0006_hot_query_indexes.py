@@ -0,0 +1,32 @@
+# Generated by Django 3.2.19 on 2026-10-18 12:21
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Indexes are built without locking tables for writes.
+    atomic = False
+
+    dependencies = [
+        ('coupons', '0005_ticket_progress'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='coupon',
+            index=models.Index(condition=models.Q(user__isnull=True), fields=['distance', 'expiration_date'], name='coupon_available_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ticket',
+            index=models.Index(fields=['origin', 'destination', 'unique_number'], name='ticket_dedup_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ticket',
+            index=models.Index(fields=['user', '-created_at'], name='ticket_user_history_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(status='pending'), fields=['created_at'], name='ticket_pending_idx'),
+        ),
+    ]
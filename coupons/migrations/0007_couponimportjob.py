@@ -0,0 +1,33 @@
+# Generated by Django 3.2.19 on 2026-10-18 13:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('coupons', '0006_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CouponImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('rows_processed', models.PositiveIntegerField(default=0, verbose_name='Rows processed')),
+                ('inserted', models.PositiveIntegerField(default=0, verbose_name='Inserted')),
+                ('updated', models.PositiveIntegerField(default=0, verbose_name='Updated')),
+                ('duplicates', models.PositiveIntegerField(default=0, verbose_name='Duplicates')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Errors')),
+                ('info', models.JSONField(blank=True, default=list, verbose_name='Information')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
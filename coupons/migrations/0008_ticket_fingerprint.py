@@ -0,0 +1,31 @@
+# Generated by Django 3.2.19 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0007_couponimportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Digest'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Perceptual hash'),
+        ),
+        migrations.AddConstraint(
+            model_name='ticket',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'failed'), _negated=True), fields=('digest',), name='unique_ticket_digest'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('perceptual_hash__isnull', False), models.Q(('status', 'failed'), _negated=True)), fields=['user'], name='ticket_user_perceptual_idx'),
+        ),
+    ]
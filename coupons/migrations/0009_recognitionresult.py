@@ -0,0 +1,27 @@
+# Generated by Django 3.2.19 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0008_ticket_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecognitionResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, verbose_name='Digest')),
+                ('engine_version', models.CharField(max_length=30, verbose_name='Engine version')),
+                ('result', models.JSONField(default=list, verbose_name='Result')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='recognitionresult',
+            constraint=models.UniqueConstraint(fields=('digest', 'engine_version'), name='unique_recognition_result'),
+        ),
+    ]
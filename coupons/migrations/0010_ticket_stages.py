@@ -0,0 +1,23 @@
+# Generated by Django 3.2.19 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0009_recognitionresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='words',
+            field=models.JSONField(blank=True, null=True, verbose_name='Recognized words'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='stations',
+            field=models.JSONField(blank=True, null=True, verbose_name='Recognized stations'),
+        ),
+    ]
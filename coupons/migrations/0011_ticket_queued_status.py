@@ -0,0 +1,18 @@
+# Generated by Django 3.2.19 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0010_ticket_stages'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticket',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status'),
+        ),
+    ]
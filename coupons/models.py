@@ -17,6 +17,12 @@ class Coupon(models.Model):
     expiration_date = models.DateField(verbose_name='expiration date', auto_now_add=False, auto_created=False)
     user = models.ForeignKey(BoltUser, on_delete=models.CASCADE, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['distance', 'expiration_date'], condition=models.Q(user__isnull=True),
+                         name='coupon_available_idx'),
+        ]
+
     def __str__(self) -> str:
         return f'{self.name} Distance: {self.distance} Price: {self.price} Expired at: {self.expiration_date}'
 
@@ -26,11 +32,96 @@ class Ticket(models.Model):
     MAX_LENGTH = {
         'ORIGIN': 30,
         'DESTINATION': 30,
-        'UNIQUE_NUMBER': 60
+        'UNIQUE_NUMBER': 60,
+        'STATUS': 10,
+        'ERROR': 255,
+        'DIGEST': 64,
+        'PERCEPTUAL_HASH': 64,
     }
+
+    class Status(models.TextChoices):
+        """Recognition status of ticket."""
+        QUEUED = 'queued', 'Queued'
+        PENDING = 'pending', 'Pending'
+        PROCESSING = 'processing', 'Processing'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
     file = models.FileField(upload_to='tickets/')
     origin = models.CharField(verbose_name='Origin', max_length=MAX_LENGTH['ORIGIN'], blank=True, null=True)
     destination = models.CharField(verbose_name='Destination', max_length=MAX_LENGTH['DESTINATION'], blank=True, null=True)
     unique_number = models.CharField(verbose_name='Unique number', max_length=MAX_LENGTH['UNIQUE_NUMBER'], unique=True, null=True)
     user = models.ForeignKey(BoltUser, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(verbose_name='Status', max_length=MAX_LENGTH['STATUS'], choices=Status.choices, default=Status.PENDING)
+    pages_count = models.PositiveIntegerField(verbose_name='Pages count', null=True, blank=True)
+    pages_processed = models.PositiveIntegerField(verbose_name='Pages processed', default=0)
+    error = models.CharField(verbose_name='Error', max_length=MAX_LENGTH['ERROR'], blank=True, default='')
+    digest = models.CharField(verbose_name='Digest', max_length=MAX_LENGTH['DIGEST'], blank=True, null=True)
+    perceptual_hash = models.CharField(verbose_name='Perceptual hash', max_length=MAX_LENGTH['PERCEPTUAL_HASH'],
+                                       blank=True, null=True)
+    words = models.JSONField(verbose_name='Recognized words', blank=True, null=True)
+    stations = models.JSONField(verbose_name='Recognized stations', blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['digest'], condition=~models.Q(status='failed'),
+                                    name='unique_ticket_digest'),
+        ]
+        indexes = [
+            models.Index(fields=['origin', 'destination', 'unique_number'], name='ticket_dedup_idx'),
+            models.Index(fields=['user', '-created_at'], name='ticket_user_history_idx'),
+            models.Index(fields=['created_at'], condition=models.Q(status='pending'), name='ticket_pending_idx'),
+            models.Index(fields=['user'], condition=models.Q(perceptual_hash__isnull=False) & ~models.Q(status='failed'),
+                         name='ticket_user_perceptual_idx'),
+        ]
+
+
+class CouponImportJob(models.Model):
+    """Describe background import of coupons from file."""
+    MAX_LENGTH = {
+        'STATUS': 10,
+    }
+
+    class Status(models.TextChoices):
+        """Status of import job."""
+        PENDING = 'pending', 'Pending'
+        PROCESSING = 'processing', 'Processing'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    file = models.FileField(upload_to='imports/')
+    status = models.CharField(verbose_name='Status', max_length=MAX_LENGTH['STATUS'], choices=Status.choices, default=Status.PENDING)
+    rows_processed = models.PositiveIntegerField(verbose_name='Rows processed', default=0)
+    inserted = models.PositiveIntegerField(verbose_name='Inserted', default=0)
+    updated = models.PositiveIntegerField(verbose_name='Updated', default=0)
+    duplicates = models.PositiveIntegerField(verbose_name='Duplicates', default=0)
+    errors = models.JSONField(verbose_name='Errors', default=list, blank=True)
+    info = models.JSONField(verbose_name='Information', default=list, blank=True)
+    user = models.ForeignKey(BoltUser, on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'{self.file.name} {self.status} Created at: {self.created_at}'
+
+
+class RecognitionResult(models.Model):
+    """Describe stations recognized from file, stored by digest of file content and engine version."""
+    MAX_LENGTH = {
+        'DIGEST': 64,
+        'ENGINE_VERSION': 30,
+    }
+
+    digest = models.CharField(verbose_name='Digest', max_length=MAX_LENGTH['DIGEST'])
+    engine_version = models.CharField(verbose_name='Engine version', max_length=MAX_LENGTH['ENGINE_VERSION'])
+    result = models.JSONField(verbose_name='Result', default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['digest', 'engine_version'], name='unique_recognition_result'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.digest} {self.engine_version}'
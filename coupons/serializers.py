@@ -22,3 +22,10 @@ class TicketSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ticket
         fields = ['id', 'origin', 'destination']
+
+
+class TicketStatusSerializer(serializers.ModelSerializer):
+    """Ticket recognition status serializer."""
+    class Meta:
+        model = Ticket
+        fields = ['id', 'status', 'pages_count', 'pages_processed', 'error']
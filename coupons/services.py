@@ -1,56 +1,271 @@
 """Services for coupons app."""
+import csv
+import hashlib
+import heapq
+import io
+import json
+import logging
+import math
+import os
 import re
+import threading
+import time
 from abc import abstractmethod
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from typing import Union
 
+import cv2
+import numpy
 import PyPDF2
+from cachetools import TTLCache
 from django.conf import settings
-from django.core.files.uploadedfile import (InMemoryUploadedFile,
-                                            TemporaryUploadedFile)
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.db.models.fields.files import FieldFile
 from django.db.models.query import QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django_redis import get_redis_connection
 from easyocr import Reader
 from googlemaps import Client
 from googlemaps.exceptions import ApiError
+from openpyxl import load_workbook
+from PIL import Image, ImageOps
+from psycopg2.extras import execute_values
+from redis.exceptions import LockError
+from requests.adapters import HTTPAdapter
 from rest_framework.exceptions import ValidationError
 from rest_framework.status import HTTP_400_BAD_REQUEST
 from xlrd import open_workbook, xldate_as_tuple
 from xlrd.biffh import XLRDError
-from xlrd.book import Book
-from xlrd.sheet import Sheet
-from xlrd.xldate import XLDateAmbiguous
+from xlrd.xldate import XLDateError
 
-from coupons.constants import DISTANCE_INDEX, PRICE_AND_DISTANCE
-from coupons.enums import CouponsErrors, ImageStationRecognitionErrors
-from coupons.models import Coupon, Ticket
-from user_auth.models import BoltUser
+from coupons.constants import (COUPON_IMPORT_HEADERS, DISTANCE_INDEX,
+                               PRICE_AND_DISTANCE)
+from coupons.enums import (CouponsErrors, DistanceErrors,
+                           ImageStationRecognitionErrors,
+                           TicketSchedulerErrors)
+from coupons.models import Coupon, CouponImportJob, RecognitionResult, Ticket
+from user_auth.models import BoltUser, DistanceLedgerEntry
 
 from .constants import APPOINTMENT, DEPARTURE
 from .logger import ExcelLogger
-from .utils import is_float, is_integer
+from .utils import has_image_extension
+
+logger = logging.getLogger(__name__)
+
+
+class CouponInventoryService:
+    """
+    The service describes methods of working with counters of available coupons.
+
+    Counters are kept in Redis hash and changed with `HINCRBY` after the transaction which changed coupons
+    is committed, so claims of the same tier never wait for each other on a counter row.
+    Counters are rebuilt from coupons table if the hash is lost.
+    """
+    KEY = 'coupon-inventory'
+    READY_FIELD = 'ready'
+    # Counters are changed only while hash exists, otherwise it is rebuilt from coupons table on next read.
+    ADJUST_SCRIPT = """
+    if redis.call('exists', KEYS[1]) == 0 then
+        return {}
+    end
+    local counts = {}
+    for index = 1, #ARGV, 2 do
+        counts[#counts + 1] = redis.call('hincrby', KEYS[1], ARGV[index], ARGV[index + 1])
+    end
+    return counts
+    """
+
+    @classmethod
+    def get_inventory(cls) -> list:
+        """
+        Get available coupons count of every tier.
+
+        :return: [{'distance': distance, 'price': price, 'available': count, 'low_stock': bool}, ...]
+        """
+        counters = get_redis_connection('default').hgetall(cls.KEY)
+        if not counters:
+            counters = cls.recount()
+
+        inventory = []
+        for field, available in counters.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            if field == cls.READY_FIELD:
+                continue
+
+            distance, price = map(int, field.split(':'))
+            inventory.append({
+                'distance': distance,
+                'price': price,
+                'available': int(available),
+                'low_stock': int(available) < settings.COUPON_LOW_STOCK_THRESHOLD,
+            })
+
+        return sorted(inventory, key=lambda tier: (tier['distance'], tier['price']))
+
+    @classmethod
+    def has_available(cls, max_distance: int) -> bool:
+        """
+        Check if any coupon with distance not bigger than `max_distance` is available.
+
+        :param max_distance: user distance.
+        :return: True if available.
+        """
+        return any(tier['available'] > 0 and tier['distance'] <= max_distance for tier in cls.get_inventory())
+
+    @classmethod
+    def adjust(cls, tiers: dict) -> None:
+        """
+        Change available coupons count of tiers once current transaction is committed.
+
+        :param tiers: (distance, price) mapped to change of count.
+        :return: None.
+        """
+        tiers = {tier: delta for tier, delta in tiers.items() if delta}
+        if tiers:
+            transaction.on_commit(lambda: cls._increment(tiers))
+
+    @classmethod
+    def recount(cls) -> dict:
+        """
+        Rebuild counters from coupons table.
+
+        :return: counters written to Redis.
+        """
+        tiers = Coupon.objects.filter(user__isnull=True).values('distance', 'price').annotate(available=Count('id'))
+        counters = {cls.make_field(tier['distance'], tier['price']): tier['available'] for tier in tiers}
+        counters[cls.READY_FIELD] = 0
+
+        pipeline = get_redis_connection('default').pipeline()
+        pipeline.delete(cls.KEY)
+        pipeline.hset(cls.KEY, mapping=counters)
+        pipeline.execute()
+
+        return counters
+
+    @classmethod
+    def purge_expired(cls, batch_size: int = settings.COUPON_PURGE_BATCH_SIZE) -> int:
+        """
+        Delete expired unassigned coupons in batches.
+
+        :param batch_size: count of coupons deleted in one transaction.
+        :return: count of deleted coupons.
+        """
+        expired = Coupon.objects.filter(user__isnull=True, expiration_date__lt=timezone.localdate())
+        deleted = 0
+
+        while True:
+            with transaction.atomic():
+                batch = list(expired.select_for_update(skip_locked=True).values_list('id', 'distance', 'price')[:batch_size])
+                if not batch:
+                    break
+
+                # Signals and `on_delete` are skipped on purpose, inventory is adjusted once per batch,
+                # ledger entries of coupons which were claimed and unassigned later are detached here.
+                coupon_ids = [coupon_id for coupon_id, _, _ in batch]
+                DistanceLedgerEntry.objects.filter(coupon_id__in=coupon_ids).update(coupon=None)
+                Coupon.objects.filter(id__in=coupon_ids)._raw_delete(Coupon.objects.db)
+                tiers = Counter((distance, price) for _, distance, price in batch)
+                cls.adjust({tier: -count for tier, count in tiers.items()})
+
+            deleted += len(batch)
+
+        return deleted
+
+    @classmethod
+    def make_field(cls, distance: int, price: int) -> str:
+        """Make hash field of tier."""
+        return f'{distance}:{price}'
+
+    @classmethod
+    def _increment(cls, tiers: dict) -> None:
+        """Increment counters and signal tiers which have just fallen below low stock threshold."""
+        redis = get_redis_connection('default')
+        arguments = []
+        for (distance, price), delta in tiers.items():
+            arguments.extend((cls.make_field(distance, price), delta))
+
+        counts = redis.register_script(cls.ADJUST_SCRIPT)(keys=[cls.KEY], args=arguments)
+
+        for ((distance, price), delta), available in zip(tiers.items(), counts):
+            if available < settings.COUPON_LOW_STOCK_THRESHOLD <= available - delta:
+                logger.warning('Low stock of coupons with distance %s and price %s: %s left.',
+                               distance, price, available)
 
 
 class CouponService:
     """The service describes methods of working with the Coupon instance."""
     def get_coupon_by_distance(self, user: BoltUser) -> Coupon or ValidationError:
         """
-        Get coupon by distance and assign it to user.
+        Get coupon of the best tier user can afford, assign it to user and debit coupon distance from user.
         
         :param user: user.
         :raises ValidationError: if any coupons do not exists.
         :return: coupon.
         """
-        coupons = Coupon.objects.filter(user__isnull=True)
+        return self._claim_coupons(user, limit=1)[0]
+
+    def get_coupons_by_distance(self, user: BoltUser) -> list or ValidationError:
+        """
+        Get greedy combination of coupons for whole user distance, assign them to user
+        and debit their distance from user.
+
+        :param user: user.
+        :raises ValidationError: if any coupons do not exists.
+        :return: list of coupons.
+        """
+        return self._claim_coupons(user)
+
+    def _claim_coupons(self, user: BoltUser, limit: int or None = None) -> list or ValidationError:
+        """
+        Claim coupons for user in one transaction.
+
+        Coupon rows are claimed with `SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent requests
+        never get the same coupon and never wait for each other.
+
+        :param user: user.
+        :param limit: max count of coupons, not limited if None.
+        :raises ValidationError: if any coupons do not exists or user distance is too small.
+        :return: list of coupons.
+        """
         self._check_distance(user.distance)
-        coupon = self._get_coupon_by_distance(user.distance, coupons)
 
-        if not coupon:
+        if not CouponInventoryService.has_available(user.distance):
             raise ValidationError(detail=CouponsErrors.NO_COUPONS_AVAILIABLE.value, code=HTTP_400_BAD_REQUEST)
 
-        coupon.user = user
-        coupon.save()
+        with transaction.atomic():
+            coupons = self._get_coupons_by_distance(user.distance, self.get_claimable_coupons(), limit)
+
+            if not coupons:
+                raise ValidationError(detail=CouponsErrors.NO_COUPONS_AVAILIABLE.value, code=HTTP_400_BAD_REQUEST)
+
+            distance = sum(coupon.distance for coupon in coupons)
+            debited = BoltUser.objects.filter(id=user.id, distance__gte=distance).update(
+                distance=F('distance') - distance
+            )
+            if not debited:
+                raise ValidationError(detail=CouponsErrors.TOO_SMALL_DISTANCE.value, code=HTTP_400_BAD_REQUEST)
+
+            Coupon.objects.filter(id__in=[coupon.id for coupon in coupons]).update(user=user)
+            DistanceLedgerEntry.objects.bulk_create(
+                DistanceLedgerEntry(user=user, distance=-coupon.distance, coupon=coupon) for coupon in coupons
+            )
+            for coupon in coupons:
+                coupon.user = user
 
-        return coupon
+            claimed = Counter((coupon.distance, coupon.price) for coupon in coupons)
+            CouponInventoryService.adjust({tier: -count for tier, count in claimed.items()})
+
+        user.refresh_from_db(fields=['distance'])
+
+        return coupons
         
     @staticmethod        
     def _check_distance(distance: int) -> None or ValidationError:
@@ -65,37 +280,276 @@ class CouponService:
             raise ValidationError(detail=CouponsErrors.TOO_SMALL_DISTANCE.value, code=HTTP_400_BAD_REQUEST)
 
     @staticmethod
-    def _get_coupon_by_distance(distance: int, coupons: QuerySet[Coupon]) -> Coupon or None:
+    def get_claimable_coupons() -> QuerySet[Coupon]:
+        """
+        Get unassigned coupons which are not expired, rows are locked with `SELECT ... FOR UPDATE SKIP LOCKED`.
+
+        :return: queryset to be evaluated in transaction.
+        """
+        return Coupon.objects.select_for_update(skip_locked=True).filter(
+            user__isnull=True, expiration_date__gte=timezone.localdate()
+        )
+
+    @staticmethod
+    def get_tier_coupons(coupons: QuerySet[Coupon], tier_distance: int, count: int) -> QuerySet[Coupon]:
+        """
+        Get coupons of tier which expire soonest.
+
+        :param coupons: claimable coupons.
+        :param tier_distance: distance of tier.
+        :param count: max count of coupons.
+        :return: queryset of coupons.
+        """
+        return coupons.filter(distance=tier_distance).order_by('expiration_date', 'id')[:count]
+
+    @staticmethod
+    def _get_coupons_by_distance(distance: int, coupons: QuerySet[Coupon], limit: int or None = None) -> list:
         """
-        Get coupon by distance.
+        Get coupons by distance, starting from the most expensive tier user can afford.
+        Coupons which expire soonest are taken first.
         
         :param distance: user distance.
         :param coupons: list of availiable coupons.
-        :return: coupon if found else None.
+        :param limit: max count of coupons, not limited if None.
+        :return: list of coupons, empty if not found.
+        """
+        selected = []
+        tiers = sorted({tier[DISTANCE_INDEX] for tier in PRICE_AND_DISTANCE}, reverse=True)
+
+        for tier_distance in tiers:
+            count = distance // tier_distance
+            if limit is not None:
+                count = min(count, limit - len(selected))
+            if count <= 0:
+                continue
+
+            claimed = list(CouponService.get_tier_coupons(coupons, tier_distance, count))
+            selected.extend(claimed)
+            distance -= tier_distance * len(claimed)
+
+        return selected
+
+
+class RowsReader:
+    """Lazy reader of rows from tabular file."""
+    extensions = ()
+
+    def __init__(self, file: UploadedFile, sheet_index: Union[int, None] = None, sheet_name: str = '') -> None:
+        self.file = file
+        self.sheet_index = sheet_index
+        self.sheet_name = sheet_name
+
+    @classmethod
+    def for_file(cls, file: UploadedFile, sheet_index: Union[int, None] = None, sheet_name: str = '') -> 'RowsReader':
+        """
+        Get reader for file by its extension.
+
+        :param file: uploaded file.
+        :param sheet_index: sheet index. Start from zero.
+        :param sheet_name: sheet name.
+        :raises ValueError: if file format is not supported.
+        :return: reader.
+        """
+        for reader_class in cls.__subclasses__():
+            if file.name.lower().endswith(reader_class.extensions):
+                return reader_class(file, sheet_index, sheet_name)
+
+        raise ValueError(f'File format of {file.name} is not supported.')
+
+    @abstractmethod
+    def rows(self):
+        """
+        Read rows one by one.
+
+        :return: generator of lists with cell values, headers are the first row.
+        """
+
+    @abstractmethod
+    def to_date(self, value) -> datetime:
+        """
+        Convert cell value to date.
+
+        :param value: cell value.
+        :raises ValueError: if value is not a date.
+        :return: date.
         """
-        if distance >= PRICE_AND_DISTANCE[0][DISTANCE_INDEX]:
-            return coupons.filter(distance=PRICE_AND_DISTANCE[0][DISTANCE_INDEX]).first()
+
+    def to_dates(self, column: numpy.ndarray) -> tuple:
+        """
+        Convert column of cell values to dates.
+
+        Whole column is converted at once, values are converted one by one only if it fails.
+
+        :param column: cell values.
+        :return: array of dates (datetime64) and mask of valid values.
+        """
+        try:
+            dates = self._to_dates(column)
+            return dates, ~numpy.isnat(dates)
+        except (ValueError, TypeError):
+            pass
+
+        dates = numpy.full(len(column), numpy.datetime64('NaT'), dtype='datetime64[s]')
+        for index, value in enumerate(column):
+            try:
+                dates[index] = self.to_date(value)
+            except ValueError:
+                continue
+
+        return dates, ~numpy.isnat(dates)
+
+    def _to_dates(self, column: numpy.ndarray) -> numpy.ndarray:
+        """
+        Convert whole column of cell values to dates.
+
+        :param column: cell values.
+        :raises ValueError: if any value can not be converted.
+        :return: array of dates (datetime64), NaT for empty values.
+        """
+        raise ValueError('Column can not be converted at once.')
+
+    def _get_path(self) -> str or None:
+        """Get path of file on disk if file is not kept in memory."""
+        if isinstance(self.file, TemporaryUploadedFile):
+            return self.file.temporary_file_path()
+
+        if isinstance(self.file, FieldFile):
+            return self.file.path
+
+
+class XLSRowsReader(RowsReader):
+    """Reader of rows from .xls file."""
+    extensions = ('.xls',)
+
+    def __init__(self, file: UploadedFile, sheet_index: Union[int, None] = None, sheet_name: str = '') -> None:
+        super().__init__(file, sheet_index, sheet_name)
+        path = self._get_path()
+        # File on disk is memory mapped by xlrd, sheets are loaded on demand.
+        if path:
+            self.workbook = open_workbook(path, on_demand=True)
+        else:
+            self.workbook = open_workbook(file_contents=file.read(), on_demand=True)
+
+    def rows(self):
+        try:
+            sheet = self.workbook.sheet_by_name(self.sheet_name) if self.sheet_name else \
+                self.workbook.sheet_by_index(self.sheet_index or 0)
+        except (XLRDError, IndexError) as error:
+            raise ValueError('Sheet does not exists.') from error
+
+        for row in sheet.get_rows():
+            yield [cell.value for cell in row]
+
+        self.workbook.release_resources()
+
+    def to_date(self, value) -> datetime:
+        try:
+            return datetime(*xldate_as_tuple(value, self.workbook.datemode))
+        except (XLDateError, TypeError) as error:
+            raise ValueError('Invalid date.') from error
+
+    def _to_dates(self, column: numpy.ndarray) -> numpy.ndarray:
+        serials = column.astype(float)
+        epoch = numpy.datetime64('1904-01-01' if self.workbook.datemode else '1899-12-30', 's')
+        dates = epoch + numpy.round(serials * 24 * 60 * 60).astype('timedelta64[s]')
+
+        # Serials before 1900-03-01 are ambiguous in 1900 date system, same as in xlrd.
+        if not self.workbook.datemode:
+            dates[serials < 61] = numpy.datetime64('NaT')
+
+        return dates
+
+
+class XLSXRowsReader(RowsReader):
+    """Reader of rows from .xlsx file in read-only mode."""
+    extensions = ('.xlsx',)
+
+    def __init__(self, file: UploadedFile, sheet_index: Union[int, None] = None, sheet_name: str = '') -> None:
+        super().__init__(file, sheet_index, sheet_name)
+        self.workbook = load_workbook(self._get_path() or file, read_only=True, data_only=True)
+
+    def rows(self):
+        try:
+            sheet = self.workbook[self.sheet_name] if self.sheet_name else \
+                self.workbook.worksheets[self.sheet_index or 0]
+        except (KeyError, IndexError) as error:
+            raise ValueError('Sheet does not exists.') from error
+
+        try:
+            for row in sheet.iter_rows(values_only=True):
+                yield list(row)
+        finally:
+            self.workbook.close()
+
+    def to_date(self, value) -> datetime:
+        if isinstance(value, datetime):
+            return value
+
+        raise ValueError('Invalid date.')
+
+    def _to_dates(self, column: numpy.ndarray) -> numpy.ndarray:
+        return column.astype('datetime64[s]')
+
+
+class CSVRowsReader(RowsReader):
+    """Reader of rows from .csv file."""
+    extensions = ('.csv',)
+    DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+
+    def rows(self):
+        path = self._get_path()
+        file = open(path, encoding='utf-8-sig', newline='') if path else \
+            io.TextIOWrapper(self.file, encoding='utf-8-sig', newline='')
+
+        with file:
+            yield from csv.reader(file)
+
+    def to_date(self, value) -> datetime:
+        for date_format in self.DATE_FORMATS:
+            try:
+                return datetime.strptime(value.strip(), date_format)
+            except (ValueError, AttributeError):
+                continue
+
+        raise ValueError('Invalid date.')
+
+    def _to_dates(self, column: numpy.ndarray) -> numpy.ndarray:
+        return numpy.char.strip(column.astype(str)).astype('datetime64[D]').astype('datetime64[s]')
 
 
 class ExcelParserService:
-    """Reading data from Excel into a dictionary."""
-    def __init__(self, file: InMemoryUploadedFile, headers_map_fields: dict or None, logger: ExcelLogger) -> None:
+    """Reading rows of Excel or CSV file into dictionaries."""
+    def __init__(self, file: UploadedFile, headers_map_fields: dict or None, logger: ExcelLogger) -> None:
         self._logger = logger
-        self.workbook = self.get_workbook(file)
+        self._file = file
         self._headers_map_fields = headers_map_fields
 
-    def get_headers(self, sheet: Sheet) -> list or None:
+    def get_reader(self, sheet_index: Union[int, None] = None, sheet_name: str = '') -> RowsReader or None:
+        """
+        Get rows reader of file.
+
+        :param sheet_index: sheet index. Start from zero.
+        :param sheet_name: sheet name.
+        :return: reader or None if file can not be read.
+        """
+        try:
+            return RowsReader.for_file(self._file, sheet_index, sheet_name)
+        except Exception as error:
+            self._handle_error(error, self._logger.error_patterns['no_excel'])
+
+    def get_headers(self, row: list or None) -> list or None:
         """
-        Get headers from sheet.
+        Get headers from the first row.
         
-        :param sheet: sheet from excel file.
+        :param row: the first row of file.
         :return: headers.
         """
-        if not sheet:
+        if not row:
             self._handle_error(Exception('Error during excel file import by user'), self._logger.error_patterns['only_headers'])
+            return None
 
         try:
-            headers = [cell for cell in sheet.row_values(0)]
+            headers = [cell for cell in row]
             self.validate_headers(headers)
 
             if self._headers_map_fields:
@@ -120,7 +574,7 @@ class ExcelParserService:
 
         return mapped
 
-    def validate_headers(self, headers: tuple) -> None:
+    def validate_headers(self, headers: list) -> None:
         """
         Validate headers.
         
@@ -128,107 +582,83 @@ class ExcelParserService:
         :return: None
         """
         if len(headers) < len(self._headers_map_fields):
-            self._handle_error(Exception("Broken headers.", self._logger['only_headers']))
-
-    def get_rows(self, sheet: Sheet) -> list:
-        """
-        Get rows from sheet.
-
-        :param sheet: sheet from excel file.
-        :return: list of rows.
-        """
-        rows = []
-        try:
-            for row in list(sheet.get_rows())[1:]:
-                self.validate_row(row)
-                rows.append(row)
-        except Exception as error:
-            self._handle_error(error, self._logger.error_patterns.get('only_headers', ''))
-
-        return rows
+            self._handle_error(Exception("Broken headers."), self._logger.error_patterns['only_headers'])
 
-    def validate_row(self, row: list) -> None:
+    def get_rows(self, rows, reader: RowsReader, chunk_size: int = settings.COUPON_IMPORT_CHUNK_SIZE):
         """
-        Validate row.
+        Validate rows by chunks.
 
-        :param row: exel row.
-        :return: None
+        :param rows: iterator of rows without headers.
+        :param reader: rows reader.
+        :param chunk_size: count of rows validated at once.
+        :return: generator of valid rows.
         """
-        promocod_index = 0
-        price_index = 1
-        distance_index = 2
-        date_index = 3
-
-        if len(row[promocod_index].value) != 8 and not row[promocod_index].value.isupper():
-            self._handle_error(Exception('Invalid promocod.'), 'Неправильний формат промокоду.')
+        # The first data row goes after headers.
+        row_number = 2
+        chunk = []
 
-        if not is_float(row[price_index].value) or not is_integer(row[price_index].value):
-            self._handle_error(Exception('Invalid price.'), 'Ціна має бути написана числом.')
-
-        if not is_float(row[distance_index].value) or not is_integer(row[distance_index].value):
-            self._handle_error(Exception('Invalid distance.'), 'Відстань має бути написана числом.')
-
-        try:
-            row[date_index] = datetime(*xldate_as_tuple(row[date_index].value, self.workbook.datemode))
-        except XLDateAmbiguous:
-            self._handle_error(Exception('Invalid distance.'), 'Неправильний формат дати.')
+        for row in rows:
+            if any(value not in (None, '') for value in row):
+                chunk.append((row_number, row))
+            row_number += 1
 
-    def get_workbook(self, file: InMemoryUploadedFile) -> Book or None:
-        """
-        Get workbook of excel file.
+            if len(chunk) >= chunk_size:
+                yield from self.validate_rows(chunk, reader)
+                chunk = []
 
-        :param file: excel file.
-        :return: workbook.
-        """
-        try:
-            return open_workbook(file_contents=file.read())
-        except Exception as error:
-            self._handle_error(error, self._logger.error_patterns['no_excel'])
+        if chunk:
+            yield from self.validate_rows(chunk, reader)
 
-    def get_sheet(self, sheet_index: Union[int, None] = None, sheet_name: str='') -> Sheet or None:
+    def validate_rows(self, chunk: list, reader: RowsReader) -> list:
         """
-        Get a sheet from an Excel file by sheet name or sheet index.
-        
-        :param sheet_index: sheet index. Start from zero.
-        :param sheet_name: sheet name.
+        Validate chunk of rows column by column.
 
-        :return: sheet.
+        :param chunk: list of (row number, row values) pairs.
+        :param reader: rows reader.
+        :return: list of valid rows with converted values.
         """
-        result = self.__get_sheet_by_name(sheet_name)
-        if result: return result
-            
-        result = self.__get_sheet_by_index(sheet_index)
-        if result: return result
-            
-    def __get_sheet_by_name(self, sheet_name: str) -> Sheet or None:
-        """
-        Get sheet by name.
+        columns_count = 4
+        row_numbers = numpy.array([row_number for row_number, _ in chunk])
+        promocodes, prices, distances, dates = (
+            numpy.array(column, dtype=object) for column in zip(*(
+                (list(row[:columns_count]) + [None] * columns_count)[:columns_count] for _, row in chunk
+            ))
+        )
+
+        promocodes = promocodes.astype(str)
+        valid_promocodes = (numpy.char.str_len(promocodes) == 8) | numpy.char.isupper(promocodes)
+        prices, valid_prices = self._to_integers(prices)
+        distances, valid_distances = self._to_integers(distances)
+        dates, valid_dates = reader.to_dates(dates)
+
+        for valid, message in ((valid_promocodes, 'Неправильний формат промокоду.'),
+                               (valid_prices, 'Ціна має бути написана числом.'),
+                               (valid_distances, 'Відстань має бути написана числом.'),
+                               (valid_dates, 'Неправильний формат дати.')):
+            for row_number in row_numbers[~valid]:
+                self._handle_error(Exception(message), f'Рядок {row_number}: {message}')
+
+        valid = valid_promocodes & valid_prices & valid_distances & valid_dates
+
+        return [list(row) for row in zip(promocodes[valid].tolist(), prices[valid].tolist(),
+                                         distances[valid].tolist(), dates[valid].tolist())]
 
-        :param workbook: workbook.
-        :param sheet_name: sheet name.
-        
-        :return: Sheet or None.
-        """
-        if sheet_name:
-            try:
-                return self.workbook.sheet_by_name(sheet_name)
-            except XLRDError as error:
-                return None
-            
-    def __get_sheet_by_index(self, sheet_index: str) -> Sheet or None:
+    @staticmethod
+    def _to_integers(column: numpy.ndarray) -> tuple:
         """
-        Get sheet by index.
+        Convert column of cell values to integers.
 
-        :param workbook: workbook.
-        :param sheet_index: sheet index.
-        
-        :return: Sheet or None.
+        :param column: cell values.
+        :return: array of integers and mask of valid values.
         """
-        if isinstance(sheet_index, int):
-            try:
-                return self.workbook.sheet_by_index(sheet_index)
-            except XLRDError as error:
-                return None
+        try:
+            numbers = column.astype(float)
+            valid = numpy.isfinite(numbers) & (numpy.mod(numbers, 1) == 0) & (numbers >= 0)
+            return numpy.where(valid, numbers, 0).astype(numpy.int64), valid
+        except (ValueError, TypeError):
+            integer, separator, fraction = numpy.char.partition(numpy.char.strip(column.astype(str)), '.').T
+            valid = numpy.char.isdigit(integer) & ((separator == '') | (numpy.char.strip(fraction, '0') == ''))
+            return numpy.where(valid, integer, '0').astype(numpy.int64), valid
 
     def _handle_error(self, error: Exception, logger_pattern: str) -> None:
         """
@@ -241,141 +671,1313 @@ class ExcelParserService:
         """
         self._logger.add_error(logger_pattern)
 
-    def to_dict(self, sheet_index: Union[int, None] = None, sheet_name: str='') -> list:
+    def iter_dicts(self, sheet_index: Union[int, None] = None, sheet_name: str = ''):
         """
-        Get Excel data as a list of dictionaries.
+        Read file data as dictionaries, row by row.
 
         :param sheet_index: index of excel sheet.
         :param sheet_name: name of excel sheet.
-        :return: list of dictionaries with excel data or None if workbook/sheet not found.
+        :return: generator of dictionaries with file data.
         """
-        if not self.workbook:
-            err_msg = 'Workbook does not exists.'
-            self._handle_error(Exception(err_msg), self._logger.error_patterns['no_excel'])
-            return []
+        reader = self.get_reader(sheet_index, sheet_name)
+        if not reader:
+            return
 
-        sheet = self.get_sheet(sheet_index, sheet_name)
+        try:
+            rows = reader.rows()
+            headers = self.get_headers(next(rows, None))
+            if not headers:
+                return
 
-        if not sheet:
-            err_msg = 'Sheet does not exists.'
-            self._handle_error(Exception(err_msg), self._logger.error_patterns['no_excel'])
-            return []
+            for row in self.get_rows(rows, reader):
+                yield dict(zip(headers, row))
+        except Exception as error:
+            self._handle_error(error, self._logger.error_patterns['no_excel'])
 
-        objects_: list = []
+    def to_dict(self, sheet_index: Union[int, None] = None, sheet_name: str='') -> list:
+        """
+        Get Excel data as a list of dictionaries.
 
-        headers = self.get_headers(sheet)
-        rows = self.get_rows(sheet)
-        
-        for row in rows:
-            objects_.append(
-                dict(
-                    zip([header for header in headers],
-                        [cell.value if hasattr(cell, 'value') else cell for cell in row])))
-            
-        return objects_
+        :param sheet_index: index of excel sheet.
+        :param sheet_name: name of excel sheet.
+        :return: list of dictionaries with excel data.
+        """
+        return list(self.iter_dicts(sheet_index, sheet_name))
 
 
-class CalculateDistanceService:
-    """Service for calculating the distance between settlements."""
-    def __init__(self) -> None:
-        """Initialize google maps client."""
-        self.gmaps = Client(key=settings.GOOGL_MAPS_API_KEY)
+class CouponImportJobService:
+    """
+    The service describes methods of working with the CouponImportJob instance.
 
-    def calculate_distance(self, origin: str, destination: str) -> int or None:
+    Import runs in one transaction, so its progress is shared through cache until job is finished.
+    """
+    CACHE_KEY = 'coupon-import-job:{job_id}'
+    CACHE_TIMEOUT = 60 * 60 * 24
+
+    def __init__(self, job: CouponImportJob) -> None:
+        self.job = job
+
+    def run(self) -> CouponImportJob:
         """
-        Calculate distance.
-        
-        :param origin: start.
-        :param destination: finish.
-        :return: distance if the direction is found, or None.
+        Import coupons from job file.
+
+        :return: finished job.
         """
+        self._update(status=CouponImportJob.Status.PROCESSING)
+
+        import_logger = ExcelLogger()
+        parser = ExcelParserService(self.job.file, COUPON_IMPORT_HEADERS, import_logger)
+        counts = {'inserted': 0, 'updated': 0, 'duplicates': 0}
         try:
-            train_distance = self.calculate_train_distance(origin, destination)
+            counts = CouponImportService(import_logger, on_progress=self.report_progress).import_coupons(
+                parser.iter_dicts(sheet_index=0)
+            )
+        except Exception as error:
+            import_logger.add_error(import_logger.error_patterns['no_excel'])
+            logger.exception('Coupon import job %s failed: %s', self.job.id, error)
 
-            return train_distance if train_distance else self.calculate_driving_distance(origin, destination)
-        except ApiError as error:
-            raise ValidationError(detail=error.message, code=HTTP_400_BAD_REQUEST)
+        status = CouponImportJob.Status.DONE
+        if import_logger.errors:
+            # Import transaction is rolled back, nothing was written.
+            status = CouponImportJob.Status.FAILED
+            counts = dict.fromkeys(counts, 0)
 
-    def calculate_train_distance(self, origin: str, destination: str) -> int or None:
+        self._update(
+            status=status, rows_processed=sum(counts.values()), errors=import_logger.errors, info=import_logger.info,
+            finished_at=timezone.now(), **counts,
+        )
+        cache.delete(self.CACHE_KEY.format(job_id=self.job.id))
+
+        return self.job
+
+    def report_progress(self, counts: dict) -> None:
         """
-        Calculate train distance.
-        
-        :param origin: start.
-        :param destination: finish.
-        :return: distance if the direction is found, or None.
+        Share counters of running import.
+
+        :param counts: counters of import service.
+        :return: None.
         """
-        directions = self.gmaps.directions(origin, destination, mode='transit', transit_mode='train')
-        return self.get_distance(directions)
+        cache.set(self.CACHE_KEY.format(job_id=self.job.id), counts, timeout=self.CACHE_TIMEOUT)
 
-    def calculate_driving_distance(self, origin: str, destination: str):
+    def get_status(self) -> dict:
         """
-        Calculate driving distance.
-        
-        :param origin: start.
-        :param destination: finish.
-        :return: distance if the direction is found, or None.
+        Get status of job with progress of running import.
+
+        :return: job status.
         """
-        directions = self.gmaps.directions(origin, destination, mode='driving')
+        status = {
+            'id': self.job.id,
+            'status': self.job.status,
+            'rows_processed': self.job.rows_processed,
+            'inserted': self.job.inserted,
+            'updated': self.job.updated,
+            'duplicates': self.job.duplicates,
+            'errors': self.job.errors,
+            'info': self.job.info,
+        }
 
-        return self.get_distance(directions)
-        
-    @staticmethod
-    def get_distance(directions: dict) -> int or None:
+        progress = cache.get(self.CACHE_KEY.format(job_id=self.job.id))
+        if progress and self.job.status == CouponImportJob.Status.PROCESSING:
+            status.update(progress, rows_processed=sum(progress.values()))
+
+        return status
+
+    def _update(self, **fields) -> None:
+        """Save job fields."""
+        for field, value in fields.items():
+            setattr(self.job, field, value)
+        self.job.save(update_fields=list(fields))
+
+
+class CouponImportService:
+    """
+    Bulk upsert of coupons imported from file.
+
+    Coupons are written with `INSERT ... ON CONFLICT` in chunks inside one transaction.
+    Coupons which are already assigned to users are never changed.
+    """
+    UPSERT_SQL = """
+        INSERT INTO {table} (name, price, distance, expiration_date) VALUES %s
+        ON CONFLICT (name) DO UPDATE SET
+            price = EXCLUDED.price, distance = EXCLUDED.distance, expiration_date = EXCLUDED.expiration_date
+        WHERE {table}.user_id IS NULL
+            AND ({table}.price, {table}.distance, {table}.expiration_date)
+                IS DISTINCT FROM (EXCLUDED.price, EXCLUDED.distance, EXCLUDED.expiration_date)
+        RETURNING name, price, distance, (xmax = 0) AS inserted
+    """
+
+    def __init__(self, logger: ExcelLogger, chunk_size: int = settings.COUPON_IMPORT_CHUNK_SIZE,
+                 on_progress=None) -> None:
         """
-        Get distance.
-        
-        :param directions: gmaps return value.
-        :return: distance if the direction is found, or None.
+        :param logger: import logger.
+        :param chunk_size: count of coupons in one upsert query.
+        :param on_progress: callable which gets counters after every chunk.
         """
-        one_kilometer_in_meters = 1000
-        if directions and len(directions) > 0:
-            route = directions[0]['legs'][0]
-            distance = int(route['distance']['value'] / one_kilometer_in_meters)
-            return distance
+        self._logger = logger
+        self._chunk_size = chunk_size
+        self._on_progress = on_progress
+        self._sql = self.UPSERT_SQL.format(table=connection.ops.quote_name(Coupon._meta.db_table))
 
+    def import_coupons(self, coupons) -> dict:
+        """
+        Insert new coupons and update changed ones.
 
-class StationRecognitionService:
-    """Service to recognite station."""
-    def __init__(self, file: TemporaryUploadedFile) -> None:
-        self.file = file
+        Nothing is written if logger got any errors while coupons were read.
 
-    @abstractmethod
-    def recognite(self) -> list:
-        """
-        Recognite origin, destination and ticket number from photo.
-        
-        :return: [{
-            'origin': start,
-            'destination': finish,
-            'ticket_number': uniquer ticket number
-        }, ...]
+        :param coupons: iterable of dictionaries with coupon fields.
+        :return: {'inserted': count, 'updated': count, 'duplicates': count}
         """
+        counts = {'inserted': 0, 'updated': 0, 'duplicates': 0}
+        seen = set()
+        chunk = []
 
-    def get_ticket_number(self) -> str:
-        """Find ticket number from string."""
-        return self.file.name
+        with transaction.atomic():
+            for coupon in coupons:
+                if coupon['name'] in seen:
+                    counts['duplicates'] += 1
+                    continue
+                seen.add(coupon['name'])
 
-    def save_ticket(self, origin: str, destination: str, number: str, user: BoltUser) -> None:
-        """Save ticket to database."""
-        tickets = Ticket.objects.filter(origin=origin, destination=destination, unique_number=number)
-        if tickets:
-            raise ValidationError(detail=ImageStationRecognitionErrors.TICKET_ALREADY_USED.value, code=HTTP_400_BAD_REQUEST)
+                chunk.append(self._to_row(coupon))
+                if len(chunk) >= self._chunk_size:
+                    self._upsert(chunk, counts)
+                    chunk = []
 
-        Ticket.objects.create(file=self.file, origin=origin, destination=destination, unique_number=number, user=user).save()
+            if chunk:
+                self._upsert(chunk, counts)
 
+            if self._logger.errors:
+                transaction.set_rollback(True)
+                return counts
 
-class ImageStationRecognitionService(StationRecognitionService):
-    """Service to recognite station from photo."""
-    def recognite(self) -> list:
-        reader = Reader(['uk'])
+        self._logger.add_info(f'Додано купонів: {counts["inserted"]}.')
+        self._logger.add_info(f'Оновлено купонів: {counts["updated"]}.')
+        self._logger.add_info(f'Пропущено купонів, які вже існують: {counts["duplicates"]}.')
 
-        result = reader.readtext(self.file.path, detail=0)
-        result_lower = [word.lower() for word in result]
+        return counts
 
-        if not result_lower:
-            raise ValidationError(detail=ImageStationRecognitionErrors.EMPTY_IMAGE.value, code=HTTP_400_BAD_REQUEST)
+    def _upsert(self, rows: list, counts: dict) -> None:
+        """
+        Upsert chunk of coupons and adjust inventory of changed tiers.
 
-        try:
+        :param rows: list of (name, price, distance, expiration_date) tuples.
+        :param counts: counters to update.
+        :return: None.
+        """
+        previous_tiers = dict(
+            (name, (distance, price)) for name, distance, price in
+            Coupon.objects.filter(name__in=[row[0] for row in rows], user__isnull=True)
+            .values_list('name', 'distance', 'price')
+        )
+
+        with connection.cursor() as cursor:
+            written = execute_values(cursor.cursor, self._sql, rows, page_size=len(rows), fetch=True)
+
+        tiers = Counter()
+        for name, price, distance, inserted in written:
+            tiers[(distance, price)] += 1
+            if inserted:
+                counts['inserted'] += 1
+            else:
+                counts['updated'] += 1
+                tiers[previous_tiers[name]] -= 1
+
+        counts['duplicates'] += len(rows) - len(written)
+        CouponInventoryService.adjust(dict(tiers))
+
+        if self._on_progress:
+            self._on_progress(dict(counts))
+
+    @staticmethod
+    def _to_row(coupon: dict) -> tuple:
+        """Convert coupon dictionary to row of upsert query."""
+        expiration_date = coupon['expiration_date']
+        if isinstance(expiration_date, datetime):
+            expiration_date = expiration_date.date()
+
+        return coupon['name'], int(coupon['price']), int(coupon['distance']), expiration_date
+
+
+class RouteDistanceCache:
+    """
+    Two-tier cache of distances between settlements.
+
+    In-process LRU is checked first, then the shared cache (Redis).
+    Missing routes are cached too, with shorter TTL.
+    Hit and miss counters are collected in process and added to counters shared by all workers with `flush_stats`.
+    """
+    MISS = object()
+    NO_ROUTE = -1
+    KEY_PREFIX = 'route-distance'
+    STATS_KEY = f'{KEY_PREFIX}:stats'
+    STATS_COUNTERS = ('local_hits', 'shared_hits', 'misses')
+
+    _local = TTLCache(maxsize=settings.ROUTE_DISTANCE_CACHE_SIZE, ttl=settings.ROUTE_DISTANCE_CACHE_TTL)
+    _lock = threading.Lock()
+    _stats = Counter()
+
+    @classmethod
+    def get(cls, origin: str, destination: str) -> int or None:
+        """
+        Get cached distance.
+
+        :param origin: start.
+        :param destination: finish.
+        :return: distance, None if route does not exist or `MISS` if pair is not cached.
+        """
+        key = cls.make_key(origin, destination)
+
+        with cls._lock:
+            distance = cls._local.get(key, cls.MISS)
+        if distance is not cls.MISS:
+            cls._count('local_hits')
+            return cls._decode(distance)
+
+        distance = cache.get(key, cls.MISS)
+        if distance is cls.MISS:
+            cls._count('misses')
+            return cls.MISS
+
+        if distance != cls.NO_ROUTE:
+            with cls._lock:
+                cls._local[key] = distance
+        cls._count('shared_hits')
+
+        return cls._decode(distance)
+
+    @classmethod
+    def set(cls, origin: str, destination: str, distance: int or None) -> None:
+        """
+        Cache distance.
+
+        :param origin: start.
+        :param destination: finish.
+        :param distance: distance or None if route does not exist.
+        :return: None.
+        """
+        key = cls.make_key(origin, destination)
+
+        if distance is None:
+            cache.set(key, cls.NO_ROUTE, timeout=settings.ROUTE_DISTANCE_NEGATIVE_CACHE_TTL)
+            return None
+
+        cache.set(key, distance, timeout=settings.ROUTE_DISTANCE_CACHE_TTL)
+        with cls._lock:
+            cls._local[key] = distance
+
+    @classmethod
+    def flush_stats(cls) -> None:
+        """Add hit and miss counters of process to shared counters."""
+        with cls._lock:
+            stats, cls._stats = cls._stats, Counter()
+        if not stats:
+            return None
+
+        pipeline = get_redis_connection('default').pipeline()
+        for counter, count in stats.items():
+            pipeline.hincrby(cls.STATS_KEY, counter, count)
+        pipeline.execute()
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """
+        Get hit and miss counters shared by all workers.
+
+        :return: {'local_hits': count, 'shared_hits': count, 'misses': count, 'hit_ratio': ratio}.
+        """
+        counters = get_redis_connection('default').hgetall(cls.STATS_KEY)
+        counters = {(key.decode() if isinstance(key, bytes) else key): int(value) for key, value in counters.items()}
+        stats = {counter: counters.get(counter, 0) for counter in cls.STATS_COUNTERS}
+
+        lookups = sum(stats.values())
+        stats['hit_ratio'] = round((stats['local_hits'] + stats['shared_hits']) / lookups, 4) if lookups else None
+
+        return stats
+
+    @classmethod
+    def make_key(cls, origin: str, destination: str) -> str:
+        """
+        Make cache key from normalised pair of settlements.
+
+        :param origin: start.
+        :param destination: finish.
+        :return: cache key.
+        """
+        pair = f'{cls.normalise(origin)}:{cls.normalise(destination)}'
+        return f'{cls.KEY_PREFIX}:{hashlib.md5(pair.encode()).hexdigest()}'
+
+    @staticmethod
+    def normalise(settlement: str) -> str:
+        """Normalise settlement name."""
+        return ' '.join(settlement.lower().split())
+
+    @classmethod
+    def _decode(cls, distance: int) -> int or None:
+        """Convert cached value to distance."""
+        return None if distance == cls.NO_ROUTE else distance
+
+    @classmethod
+    def _count(cls, counter: str) -> None:
+        """Increment hit/miss counter."""
+        with cls._lock:
+            cls._stats[counter] += 1
+
+
+class StationGraph:
+    """
+    Railway station graph loaded from bundled data file.
+
+    Stations are stored by index, segments as compact adjacency lists of (station index, km) pairs.
+    """
+    EARTH_RADIUS = 6371
+    NAME_TABLE = str.maketrans({**{char: None for char in ' \n\t0123456789'}, '’': "'", 'ʼ': "'", '`': "'"})
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, data: dict) -> None:
+        stations = data['stations']
+        indexes = {station['id']: index for index, station in enumerate(stations)}
+
+        self.version = data.get('version')
+        self.ids = [station['id'] for station in stations]
+        self.names = [station['name'] for station in stations]
+        self.coordinates = [(math.radians(station['lat']), math.radians(station['lng'])) for station in stations]
+        self.aliases = {
+            self.normalise(alias): index
+            for index, station in enumerate(stations)
+            for alias in (station['name'], *station.get('aliases', ()))
+        }
+        self.adjacency = [[] for _ in stations]
+        for origin, destination, distance in data['segments']:
+            self.adjacency[indexes[origin]].append((indexes[destination], distance))
+            self.adjacency[indexes[destination]].append((indexes[origin], distance))
+
+        self._distances = {}
+
+    @classmethod
+    def load(cls, path: str = settings.STATION_GRAPH_PATH) -> 'StationGraph':
+        """
+        Load graph once per process.
+
+        :param path: path to data file.
+        :return: station graph.
+        """
+        if cls._instance:
+            return cls._instance
+
+        with cls._lock:
+            if not cls._instance:
+                with open(path, encoding='utf-8') as file:
+                    cls._instance = cls(json.load(file))
+
+        return cls._instance
+
+    @classmethod
+    def normalise(cls, name: str) -> str:
+        """
+        Normalise station name the same way recognition services do.
+
+        :param name: station name.
+        :return: normalised name.
+        """
+        return name.translate(cls.NAME_TABLE).lower().strip('-.,')
+
+    @cached_property
+    def name_index(self) -> 'StationNameIndex':
+        """Fuzzy index of station names."""
+        return StationNameIndex(self.aliases)
+
+    def resolve(self, name: str) -> int or None:
+        """
+        Get station index by name.
+
+        :param name: station name.
+        :return: station index or None if station is unknown.
+        """
+        return self.aliases.get(self.normalise(name))
+
+    def shortest_distance(self, origin: int, destination: int) -> int or None:
+        """
+        Get length of shortest path between stations with A* search.
+
+        Great-circle distance to destination is used as heuristic, it never exceeds railway distance.
+
+        :param origin: index of origin station.
+        :param destination: index of destination station.
+        :return: distance in kilometers or None if stations are not connected.
+        """
+        key = (origin, destination) if origin <= destination else (destination, origin)
+        if key in self._distances:
+            return self._distances[key]
+
+        distances = {origin: 0}
+        queue = [(self._great_circle(origin, destination), 0, origin)]
+        result = None
+
+        while queue:
+            _, distance, station = heapq.heappop(queue)
+            if station == destination:
+                result = distance
+                break
+            if distance > distances[station]:
+                continue
+
+            for neighbour, length in self.adjacency[station]:
+                candidate = distance + length
+                if candidate < distances.get(neighbour, candidate + 1):
+                    distances[neighbour] = candidate
+                    heapq.heappush(queue, (candidate + self._great_circle(neighbour, destination), candidate, neighbour))
+
+        self._distances[key] = result
+
+        return result
+
+    def _great_circle(self, origin: int, destination: int) -> float:
+        """Great-circle distance between stations in kilometers."""
+        latitude_1, longitude_1 = self.coordinates[origin]
+        latitude_2, longitude_2 = self.coordinates[destination]
+        haversine = (math.sin((latitude_2 - latitude_1) / 2) ** 2
+                     + math.cos(latitude_1) * math.cos(latitude_2) * math.sin((longitude_2 - longitude_1) / 2) ** 2)
+
+        return 2 * self.EARTH_RADIUS * math.asin(math.sqrt(haversine))
+
+
+class StationNameIndex:
+    """Trigram index which snaps recognized text to station."""
+    def __init__(self, aliases: dict) -> None:
+        """
+        Build index.
+
+        :param aliases: normalised station names mapped to station indexes.
+        """
+        self.aliases = aliases
+        self.stations = list(aliases.values())
+        self.trigrams_count = []
+        self.postings = defaultdict(list)
+
+        for alias_index, alias in enumerate(aliases):
+            trigrams = self.trigrams(alias)
+            self.trigrams_count.append(len(trigrams))
+            for trigram in trigrams:
+                self.postings[trigram].append(alias_index)
+
+    def match(self, name: str, max_edit_ratio: float = settings.STATION_MATCH_MAX_EDIT_RATIO) -> tuple:
+        """
+        Find station with the most similar name.
+
+        Similarity is Dice coefficient of trigram sets. Alias is a candidate only if it differs from name
+        by few edits, like recognition typos do, so a name of another settlement with the same root
+        (Кременець and Кременчук) is never matched.
+
+        :param name: normalised name.
+        :param max_edit_ratio: max count of edits per character of name.
+        :return: station index or None and confidence from 0 to 1.
+        """
+        if name in self.aliases:
+            return self.aliases[name], 1.0
+
+        trigrams = self.trigrams(name)
+        common = Counter(alias_index for trigram in trigrams for alias_index in self.postings.get(trigram, ()))
+        max_edits = max(1, int(len(name) * max_edit_ratio))
+
+        candidates = sorted(
+            ((alias_index, 2 * count / (len(trigrams) + self.trigrams_count[alias_index]))
+             for alias_index, count in common.items()),
+            key=lambda item: item[1], reverse=True,
+        )
+        for alias_index, confidence in candidates:
+            if self.edit_distance(name, self.names[alias_index], max_edits) <= max_edits:
+                return self.stations[alias_index], confidence
+
+        return None, 0.0
+
+    @cached_property
+    def names(self) -> list:
+        """Aliases in order of their indexes."""
+        return list(self.aliases)
+
+    @staticmethod
+    def edit_distance(name: str, alias: str, limit: int) -> int:
+        """
+        Get Levenshtein distance between names, computation stops once it exceeds `limit`.
+
+        :param name: normalised name.
+        :param alias: normalised alias.
+        :param limit: max distance of interest.
+        :return: distance or `limit + 1` if distance is bigger than `limit`.
+        """
+        if abs(len(name) - len(alias)) > limit:
+            return limit + 1
+
+        previous = list(range(len(alias) + 1))
+        for row, name_char in enumerate(name, start=1):
+            current = [row]
+            for column, alias_char in enumerate(alias, start=1):
+                current.append(min(
+                    previous[column] + 1,
+                    current[column - 1] + 1,
+                    previous[column - 1] + (name_char != alias_char),
+                ))
+            if min(current) > limit:
+                return limit + 1
+            previous = current
+
+        return previous[-1]
+
+    @staticmethod
+    def trigrams(name: str) -> set:
+        """Get set of trigrams of padded name."""
+        padded = f'  {name} '
+        return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class CalculateDistanceService:
+    """Service for calculating the distance between settlements."""
+    _client = None
+    _executor = None
+    _lock = threading.Lock()
+
+    def __init__(self) -> None:
+        """Initialize google maps client."""
+        self.gmaps = self.get_client()
+
+    @classmethod
+    def get_client(cls) -> Client:
+        """
+        Get google maps client shared by the process.
+
+        Connection pool of client session is sized for concurrent requests.
+
+        :return: google maps client.
+        """
+        if cls._client:
+            return cls._client
+
+        with cls._lock:
+            if not cls._client:
+                client = Client(key=settings.GOOGL_MAPS_API_KEY)
+                client.session.mount('https://', HTTPAdapter(pool_maxsize=settings.GOOGLE_MAPS_MAX_CONCURRENT_REQUESTS))
+                cls._client = client
+
+        return cls._client
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        """Get executor for google maps requests shared by the process."""
+        if cls._executor:
+            return cls._executor
+
+        with cls._lock:
+            if not cls._executor:
+                cls._executor = ThreadPoolExecutor(max_workers=settings.GOOGLE_MAPS_MAX_CONCURRENT_REQUESTS)
+
+        return cls._executor
+
+    def calculate_distance(self, origin: str, destination: str) -> int or None:
+        """
+        Calculate distance.
+
+        Distances are resolved with `StationGraph` first if `STATION_GRAPH_DISTANCES` is enabled,
+        then looked up in `RouteDistanceCache` and google maps is called only for pairs which are unknown to both.
+        
+        :param origin: start.
+        :param destination: finish.
+        :return: distance if the direction is found, or None.
+        """
+        origin = self.snap_station(origin)
+        destination = self.snap_station(destination)
+
+        if settings.STATION_GRAPH_DISTANCES:
+            distance = self.calculate_graph_distance(origin, destination)
+            if distance is not None:
+                return distance
+
+        distance = RouteDistanceCache.get(origin, destination)
+        if distance is not RouteDistanceCache.MISS:
+            return distance
+
+        executor = self.get_executor()
+        train_distance = executor.submit(self.calculate_train_distance, origin, destination)
+        driving_distance = executor.submit(self.calculate_driving_distance, origin, destination)
+
+        try:
+            distance = train_distance.result() or driving_distance.result()
+        except ApiError as error:
+            raise ValidationError(detail=error.message, code=HTTP_400_BAD_REQUEST)
+
+        RouteDistanceCache.set(origin, destination, distance)
+
+        return distance
+
+    @staticmethod
+    def snap_station(name: str) -> str:
+        """
+        Replace recognized station name with canonical name of the most similar station.
+
+        Stations missing in the graph keep recognized name and are resolved with cache and google maps.
+
+        :param name: recognized station name.
+        :raises ValidationError: if name has no letters to match and unusable names are rejected.
+        :return: canonical station name or recognized name if station is unknown.
+        """
+        graph = StationGraph.load()
+        normalised = graph.normalise(name)
+
+        if not any(char.isalpha() for char in normalised):
+            if settings.STATION_MATCH_REJECT_UNKNOWN:
+                raise ValidationError(detail=DistanceErrors.STATION_NOT_RECOGNISED.value, code=HTTP_400_BAD_REQUEST)
+            return name
+
+        station, confidence = graph.name_index.match(normalised)
+        if station is not None and confidence >= settings.STATION_MATCH_MIN_CONFIDENCE:
+            return graph.names[station]
+
+        return name
+
+    @staticmethod
+    def calculate_graph_distance(origin: str, destination: str) -> int or None:
+        """
+        Calculate distance over offline station graph.
+
+        :param origin: start.
+        :param destination: finish.
+        :return: distance if both stations are known and connected, or None.
+        """
+        graph = StationGraph.load()
+        origin_index = graph.resolve(origin)
+        destination_index = graph.resolve(destination)
+
+        if origin_index is None or destination_index is None:
+            return None
+
+        return graph.shortest_distance(origin_index, destination_index)
+
+    def calculate_train_distance(self, origin: str, destination: str) -> int or None:
+        """
+        Calculate train distance.
+        
+        :param origin: start.
+        :param destination: finish.
+        :return: distance if the direction is found, or None.
+        """
+        directions = self.gmaps.directions(origin, destination, mode='transit', transit_mode='train')
+        return self.get_distance(directions)
+
+    def calculate_driving_distance(self, origin: str, destination: str):
+        """
+        Calculate driving distance.
+        
+        :param origin: start.
+        :param destination: finish.
+        :return: distance if the direction is found, or None.
+        """
+        directions = self.gmaps.directions(origin, destination, mode='driving')
+
+        return self.get_distance(directions)
+        
+    @staticmethod
+    def get_distance(directions: dict) -> int or None:
+        """
+        Get distance.
+        
+        :param directions: gmaps return value.
+        :return: distance if the direction is found, or None.
+        """
+        one_kilometer_in_meters = 1000
+        if directions and len(directions) > 0:
+            route = directions[0]['legs'][0]
+            distance = int(route['distance']['value'] / one_kilometer_in_meters)
+            return distance
+
+
+class DistanceResolver:
+    """
+    Resolver of distances for many pairs of settlements.
+
+    Equal pairs are resolved once, different pairs are resolved concurrently.
+    """
+    def __init__(self, max_workers: int = settings.DISTANCE_RESOLUTION_WORKERS) -> None:
+        self.service = CalculateDistanceService()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+
+    def __enter__(self) -> 'DistanceResolver':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._executor.shutdown(wait=True)
+        RouteDistanceCache.flush_stats()
+
+    def submit(self, origin: str, destination: str) -> Future:
+        """
+        Start resolving distance of pair.
+
+        :param origin: start.
+        :param destination: finish.
+        :return: future with distance.
+        """
+        pair = (origin, destination)
+        if pair not in self._futures:
+            self._futures[pair] = self._executor.submit(self.service.calculate_distance, origin, destination)
+
+        return self._futures[pair]
+
+    def resolve(self, pairs: list) -> dict:
+        """
+        Resolve distances of pairs.
+
+        :param pairs: list of (origin, destination) pairs.
+        :return: pairs mapped to distance or to ValidationError if distance can not be calculated.
+        """
+        futures = {pair: self.submit(*pair) for pair in pairs}
+        distances = {}
+
+        for pair, future in futures.items():
+            try:
+                distances[pair] = future.result()
+            except ValidationError as error:
+                distances[pair] = error
+
+        return distances
+
+
+class TicketFileStorageService:
+    """
+    Content-addressed storage of uploaded ticket files.
+
+    File is stored once under the name made from hash of its content, tickets with equal files share it.
+    """
+    UPLOAD_TO = 'tickets'
+
+    def store(self, file: UploadedFile, digest: str or None = None) -> str:
+        """
+        Store uploaded file unless file with the same content is already stored.
+
+        Temporary uploaded files are moved to storage instead of being copied.
+
+        :param file: uploaded file.
+        :param digest: digest of file content if already known.
+        :return: name of stored file.
+        """
+        digest = digest or self.get_digest(file)
+        name = f'{self.UPLOAD_TO}/{digest}{os.path.splitext(file.name)[1].lower()}'
+        if default_storage.exists(name):
+            return name
+
+        file.seek(0)
+        return default_storage.save(name, file)
+
+    @staticmethod
+    def get_digest(file: UploadedFile) -> str:
+        """
+        Get SHA-256 digest of file content, reading file by chunks.
+
+        :param file: uploaded file.
+        :return: hex digest.
+        """
+        digest = hashlib.sha256()
+        for chunk in file.chunks():
+            digest.update(chunk)
+
+        return digest.hexdigest()
+
+
+class TicketFingerprintService:
+    """
+    Fingerprints of uploaded ticket file to reject resubmitted tickets before recognition.
+
+    Digest matches byte-identical files of any user. Perceptual hash matches the same photo saved again
+    with other compression, size or metadata, it is compared with photos of the same user only,
+    because tickets of one layout may look alike for different users.
+    Perceptual matching is enabled with `TICKET_PERCEPTUAL_DEDUP` only, since screenshots of different
+    e-tickets of one user (e.g. outbound and return) may match as well.
+    """
+    HASH_SIZE = 16
+
+    def __init__(self, file: UploadedFile, user: BoltUser) -> None:
+        self.file = file
+        self.user = user
+
+    @cached_property
+    def digest(self) -> str:
+        """SHA-256 digest of file content."""
+        return TicketFileStorageService.get_digest(self.file)
+
+    @cached_property
+    def perceptual_hash(self) -> str or None:
+        """256-bit difference hash of photo or None for other files."""
+        if not settings.TICKET_PERCEPTUAL_DEDUP or not has_image_extension(self.file.name):
+            return None
+
+        self.file.seek(0)
+        try:
+            with Image.open(self.file) as image:
+                image.draft('L', (self.HASH_SIZE * 16, self.HASH_SIZE * 16))
+                image = ImageOps.exif_transpose(image).convert('L')
+                pixels = numpy.asarray(image.resize((self.HASH_SIZE + 1, self.HASH_SIZE), Image.LANCZOS), dtype=numpy.int16)
+        except OSError:
+            return None
+        finally:
+            self.file.seek(0)
+
+        bits = numpy.packbits((pixels[:, 1:] > pixels[:, :-1]).ravel())
+        return bits.tobytes().hex()
+
+    def is_duplicate(self) -> bool:
+        """
+        Check if the same ticket is already uploaded and not failed.
+
+        :return: True if duplicate.
+        """
+        tickets = Ticket.objects.exclude(status=Ticket.Status.FAILED)
+        if tickets.filter(digest=self.digest).exists():
+            return True
+
+        if not self.perceptual_hash:
+            return False
+
+        perceptual_hash = int(self.perceptual_hash, 16)
+        user_hashes = tickets.filter(user=self.user, perceptual_hash__isnull=False).values_list('perceptual_hash', flat=True)
+
+        return any(
+            bin(perceptual_hash ^ int(user_hash, 16)).count('1') <= settings.TICKET_PERCEPTUAL_MAX_DISTANCE
+            for user_hash in user_hashes.iterator()
+        )
+
+
+class TicketScheduler:
+    """
+    Fair-share scheduler of ticket recognition backed by Redis.
+
+    Uploaded tickets wait in per-user queues. Only `TICKET_SCHEDULER_WINDOW` tickets are started at once,
+    free slots are shared by weighted round-robin across users, so bulk uploads of one user
+    never make tickets of other users wait behind them.
+    Slots of tickets which are never released expire after `TICKET_SCHEDULER_SLOT_TTL`.
+    Queued tickets lost by Redis are put back to queues by `restore`.
+    """
+    KEY_PREFIX = 'ticket-scheduler'
+    USERS_KEY = f'{KEY_PREFIX}:users'
+    QUEUED_KEY = f'{KEY_PREFIX}:queued'
+    STARTED_KEY = f'{KEY_PREFIX}:started'
+    WEIGHTS_KEY = f'{KEY_PREFIX}:weights'
+    LOCK_KEY = f'{KEY_PREFIX}:lock'
+
+    @staticmethod
+    def get_connection():
+        """Get Redis connection of default cache."""
+        return get_redis_connection('default')
+
+    @classmethod
+    def check_quota(cls, user_id: int) -> None:
+        """
+        Check if user may upload one more ticket.
+
+        :param user_id: id of user.
+        :raises ValidationError: if user has too many tickets in progress.
+        :return: None.
+        """
+        redis = cls.get_connection()
+        key = cls.in_flight_key(user_id)
+        redis.zremrangebyscore(key, '-inf', time.time() - settings.TICKET_SCHEDULER_SLOT_TTL)
+
+        if redis.zcard(key) >= settings.TICKET_MAX_IN_FLIGHT_PER_USER:
+            raise ValidationError(detail=TicketSchedulerErrors.TOO_MANY_TICKETS_IN_PROGRESS.value, code=HTTP_400_BAD_REQUEST)
+
+    @classmethod
+    def submit(cls, ticket: Ticket) -> None:
+        """
+        Put ticket to queue of its user.
+
+        :param ticket: queued ticket.
+        :return: None.
+        """
+        redis = cls.get_connection()
+        pipeline = redis.pipeline()
+        pipeline.zadd(cls.in_flight_key(ticket.user_id), {ticket.id: time.time()})
+        pipeline.sadd(cls.QUEUED_KEY, ticket.id)
+        pipeline.rpush(cls.queue_key(ticket.user_id), ticket.id)
+        *_, queue_length = pipeline.execute()
+
+        if queue_length == 1:
+            redis.rpush(cls.USERS_KEY, ticket.user_id)
+
+    @classmethod
+    def next_tickets(cls) -> list:
+        """
+        Pick tickets to start while there are free slots.
+
+        Every user takes as many tickets per turn as their weight is, users with tickets left go to the end of the turn.
+
+        :return: ids of tickets to start.
+        """
+        redis = cls.get_connection()
+        picked = []
+
+        try:
+            with redis.lock(cls.LOCK_KEY, timeout=10, blocking_timeout=5):
+                now = time.time()
+                redis.zremrangebyscore(cls.STARTED_KEY, '-inf', now - settings.TICKET_SCHEDULER_SLOT_TTL)
+                capacity = settings.TICKET_SCHEDULER_WINDOW - redis.zcard(cls.STARTED_KEY)
+
+                while capacity > 0:
+                    user_id = redis.lpop(cls.USERS_KEY)
+                    if user_id is None:
+                        break
+
+                    quantum = min(capacity, cls.get_weight(int(user_id)))
+                    pipeline = redis.pipeline()
+                    pipeline.lrange(cls.queue_key(int(user_id)), 0, quantum - 1)
+                    pipeline.ltrim(cls.queue_key(int(user_id)), quantum, -1)
+                    pipeline.llen(cls.queue_key(int(user_id)))
+                    ticket_ids, _, queue_length = pipeline.execute()
+
+                    if queue_length:
+                        redis.rpush(cls.USERS_KEY, user_id)
+                    picked.extend(int(ticket_id) for ticket_id in ticket_ids)
+                    capacity -= len(ticket_ids)
+
+                if picked:
+                    pipeline = redis.pipeline()
+                    pipeline.zadd(cls.STARTED_KEY, {ticket_id: now for ticket_id in picked})
+                    pipeline.srem(cls.QUEUED_KEY, *picked)
+                    pipeline.execute()
+        except LockError:
+            logger.warning('Ticket scheduler is busy, tickets are left for the next dispatch.')
+
+        return picked
+
+    @classmethod
+    def release(cls, ticket: Ticket) -> None:
+        """
+        Free slots of processed ticket.
+
+        :param ticket: done or failed ticket.
+        :return: None.
+        """
+        pipeline = cls.get_connection().pipeline()
+        pipeline.zrem(cls.in_flight_key(ticket.user_id), ticket.id)
+        pipeline.zrem(cls.STARTED_KEY, ticket.id)
+        pipeline.execute()
+
+    @classmethod
+    def discard(cls, ticket_ids: list) -> None:
+        """
+        Free slots of picked tickets which were not started.
+
+        :param ticket_ids: ids of tickets.
+        :return: None.
+        """
+        if ticket_ids:
+            cls.get_connection().zrem(cls.STARTED_KEY, *ticket_ids)
+
+    @classmethod
+    def restore(cls, tickets) -> int:
+        """
+        Put queued tickets which are missing in Redis (after flush or eviction) back to queues of their users.
+
+        :param tickets: queued tickets.
+        :return: count of restored tickets.
+        """
+        tickets = list(tickets)
+        if not tickets:
+            return 0
+
+        pipeline = cls.get_connection().pipeline()
+        for ticket in tickets:
+            pipeline.sismember(cls.QUEUED_KEY, ticket.id)
+        missing = [ticket for ticket, is_queued in zip(tickets, pipeline.execute()) if not is_queued]
+
+        for ticket in missing:
+            cls.submit(ticket)
+
+        return len(missing)
+
+    @classmethod
+    def get_weight(cls, user_id: int) -> int:
+        """Get count of tickets user takes per turn."""
+        weight = cls.get_connection().hget(cls.WEIGHTS_KEY, user_id)
+        return int(weight) if weight else settings.TICKET_SCHEDULER_DEFAULT_WEIGHT
+
+    @classmethod
+    def set_weight(cls, user_id: int, weight: int or None) -> None:
+        """Set count of tickets user takes per turn, None resets it to default."""
+        if weight is None:
+            cls.get_connection().hdel(cls.WEIGHTS_KEY, user_id)
+        else:
+            cls.get_connection().hset(cls.WEIGHTS_KEY, user_id, weight)
+
+    @classmethod
+    def queue_key(cls, user_id: int) -> str:
+        """Make key of user queue."""
+        return f'{cls.KEY_PREFIX}:queue:{user_id}'
+
+    @classmethod
+    def in_flight_key(cls, user_id: int) -> str:
+        """Make key of user tickets in progress."""
+        return f'{cls.KEY_PREFIX}:in-flight:{user_id}'
+
+
+class RecognitionResultCache:
+    """
+    Cache of stations recognized from file, keyed by digest of file content and engine version.
+
+    Shared cache (Redis) is checked first, then database, which also keeps results evicted from Redis.
+    Results of other engine versions are never returned.
+    """
+    MISS = object()
+    KEY_PREFIX = 'recognition-result'
+
+    @classmethod
+    def get(cls, digest: str, engine_version: str) -> list or object:
+        """
+        Get cached result of recognition.
+
+        :param digest: digest of file content.
+        :param engine_version: version of recognition engine.
+        :return: result of recognition or `MISS` if file is not recognized yet.
+        """
+        key = cls.make_key(digest, engine_version)
+        result = cache.get(key, cls.MISS)
+        if result is not cls.MISS:
+            return result
+
+        result = RecognitionResult.objects.filter(digest=digest, engine_version=engine_version).values_list(
+            'result', flat=True
+        ).first()
+        if result is None:
+            return cls.MISS
+
+        cache.set(key, result, timeout=settings.RECOGNITION_RESULT_CACHE_TTL)
+        return result
+
+    @classmethod
+    def set(cls, digest: str, engine_version: str, result: list) -> None:
+        """
+        Cache result of recognition.
+
+        :param digest: digest of file content.
+        :param engine_version: version of recognition engine.
+        :param result: result of recognition.
+        :return: None.
+        """
+        RecognitionResult.objects.update_or_create(
+            digest=digest, engine_version=engine_version, defaults={'result': result}
+        )
+        cache.set(cls.make_key(digest, engine_version), result, timeout=settings.RECOGNITION_RESULT_CACHE_TTL)
+
+    @classmethod
+    def make_key(cls, digest: str, engine_version: str) -> str:
+        """Make cache key from digest and engine version."""
+        return f'{cls.KEY_PREFIX}:{engine_version}:{digest}'
+
+
+class StationRecognitionService:
+    """Service to recognite station."""
+    engine_version = None
+
+    def __init__(self, file: TemporaryUploadedFile, digest: str or None = None) -> None:
+        self.file = file
+        self._digest = digest
+
+    @cached_property
+    def digest(self) -> str:
+        """Digest of file content."""
+        return self._digest or TicketFileStorageService.get_digest(self.file)
+
+    def get_ticket_number(self) -> str:
+        """Find ticket number from string."""
+        return self.file.name
+
+    def save_ticket(self, origin: str, destination: str, number: str, user: BoltUser, ticket: Ticket = None) -> Ticket:
+        """
+        Save ticket to database.
+
+        :param ticket: existing ticket to update, new ticket is created if not passed.
+        :return: saved ticket.
+        """
+        tickets = Ticket.objects.filter(origin=origin, destination=destination, unique_number=number)
+        if tickets:
+            raise ValidationError(detail=ImageStationRecognitionErrors.TICKET_ALREADY_USED.value, code=HTTP_400_BAD_REQUEST)
+
+        if ticket:
+            ticket.origin = origin
+            ticket.destination = destination
+            ticket.unique_number = number
+            ticket.save(update_fields=['origin', 'destination', 'unique_number'])
+            return ticket
+
+        return Ticket.objects.create(file=self.file, origin=origin, destination=destination, unique_number=number,
+                                     user=user, status=Ticket.Status.DONE)
+
+
+class OCREngineRegistry:
+    """
+    Process-wide registry of warm EasyOCR readers.
+
+    Readers are loaded once per worker process (see `coupons.tasks.warm_ocr_engines`)
+    and shared by every task that runs in that process.
+    """
+    _readers = {}
+    _lock = threading.Lock()
+    _inference_slots = threading.BoundedSemaphore(settings.OCR_MAX_CONCURRENT_INFERENCES)
+
+    @classmethod
+    def load(cls, languages: tuple = tuple(settings.OCR_LANGUAGES)) -> Reader:
+        """
+        Load reader for languages if it is not loaded yet.
+
+        :param languages: reader languages.
+        :return: reader.
+        """
+        key = tuple(languages)
+        reader = cls._readers.get(key)
+        if reader:
+            return reader
+
+        with cls._lock:
+            if key not in cls._readers:
+                started_at = time.perf_counter()
+                cls._readers[key] = Reader(list(key))
+                logger.info('OCR reader %s loaded in %.3fs.', key, time.perf_counter() - started_at)
+
+        return cls._readers[key]
+
+    @classmethod
+    def readtext(cls, image, languages: tuple = tuple(settings.OCR_LANGUAGES), **kwargs) -> list:
+        """
+        Run text recognition on warm reader.
+
+        :param image: path to image, bytes or numpy array.
+        :param languages: reader languages.
+        :return: recognition result of `Reader.readtext`.
+        """
+        reader = cls.load(languages)
+
+        with cls._inference_slots:
+            started_at = time.perf_counter()
+            result = reader.readtext(image, **kwargs)
+            logger.info('OCR inference took %.3fs.', time.perf_counter() - started_at)
+
+        return result
+
+    @classmethod
+    def readtext_regions(cls, image: numpy.ndarray, detection_image: numpy.ndarray, scale: float,
+                         languages: tuple = tuple(settings.OCR_LANGUAGES), **kwargs) -> list:
+        """
+        Detect text lines on downscaled copy of image and recognize only those regions.
+
+        :param image: image for recognition.
+        :param detection_image: downscaled copy of image for text detection.
+        :param scale: ratio of detection image size to image size.
+        :param languages: reader languages.
+        :return: recognition result of `Reader.recognize`.
+        """
+        reader = cls.load(languages)
+
+        with cls._inference_slots:
+            started_at = time.perf_counter()
+            horizontal_list, free_list = reader.detect(detection_image)
+            horizontal_list = [[round(coord / scale) for coord in box] for box in horizontal_list[0]]
+            free_list = [[[round(x / scale), round(y / scale)] for x, y in box] for box in free_list[0]]
+
+            result = []
+            if horizontal_list or free_list:
+                result = reader.recognize(image, horizontal_list, free_list, **kwargs)
+            logger.info('OCR inference of %s regions took %.3fs.',
+                        len(horizontal_list) + len(free_list), time.perf_counter() - started_at)
+
+        return result
+
+    @classmethod
+    def readtext_batched(cls, images: list, languages: tuple = tuple(settings.OCR_LANGUAGES), **kwargs) -> list:
+        """
+        Run text recognition for several images in one inference call.
+
+        :param images: list of paths to images, bytes or numpy arrays.
+        :param languages: reader languages.
+        :return: list of `Reader.readtext` results, one per image.
+        """
+        reader = cls.load(languages)
+
+        with cls._inference_slots:
+            started_at = time.perf_counter()
+            result = reader.readtext_batched(images, **kwargs)
+            logger.info('OCR batch inference of %s images took %.3fs.', len(images), time.perf_counter() - started_at)
+
+        return result
+
+
+class ImagePreprocessingService:
+    """Service to decode photo once, normalise its orientation and bound its resolution."""
+    def __init__(self, file) -> None:
+        self.file = file
+
+    def load(self, max_side: int = settings.OCR_MAX_IMAGE_SIDE) -> numpy.ndarray:
+        """
+        Decode photo as grayscale image with sides not bigger than `max_side`.
+
+        :param max_side: max size of image side in pixels.
+        :return: image.
+        """
+        with Image.open(self.file.path) as image:
+            # Let JPEG decoder skip pixels which would be dropped by downscaling anyway.
+            image.draft('L', (max_side * 2, max_side * 2))
+            image = ImageOps.exif_transpose(image).convert('L')
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            return numpy.asarray(image)
+
+    @staticmethod
+    def downscale(image: numpy.ndarray, max_side: int) -> tuple:
+        """
+        Downscale image to have sides not bigger than `max_side`.
+
+        :param image: image.
+        :param max_side: max size of image side in pixels.
+        :return: downscaled image and scale.
+        """
+        height, width = image.shape[:2]
+        scale = min(1.0, max_side / max(height, width))
+        if scale == 1.0:
+            return image, scale
+
+        size = (round(width * scale), round(height * scale))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+class ImageStationRecognitionService(StationRecognitionService):
+    """Service to recognite station from photo."""
+    engine_version = f'ocr:{settings.OCR_ENGINE_VERSION}'
+
+    def read_words(self) -> list:
+        """
+        Recognize words from photo.
+
+        :return: recognized words.
+        """
+        image = ImagePreprocessingService(self.file).load()
+        detection_image, scale = ImagePreprocessingService.downscale(image, settings.OCR_DETECTION_IMAGE_SIDE)
+
+        return OCREngineRegistry.readtext_regions(image, detection_image, scale, detail=0)
+
+    def extract_stations(self, result: list) -> list:
+        """
+        Extract origin, destination and ticket number from recognized words.
+
+        :param result: words recognized from photo.
+        :return: [{
+            'origin': start,
+            'destination': finish,
+            'ticket_number': uniquer ticket number
+        }]
+        """
+        result_lower = [word.lower() for word in result]
+
+        if not result_lower:
+            raise ValidationError(detail=ImageStationRecognitionErrors.EMPTY_IMAGE.value, code=HTTP_400_BAD_REQUEST)
+
+        try:
             departure = result_lower.index(DEPARTURE)
             appointment = result_lower.index(APPOINTMENT)
         except ValueError:
@@ -391,127 +1993,331 @@ class ImageStationRecognitionService(StationRecognitionService):
         }]
 
 
-class PDFStationRecognitionService(StationRecognitionService):
-    """Service to recognite station from PDF file."""
+class ImageBatchStationRecognitionService:
+    """
+    Service to recognite stations from a batch of photos with one OCR call.
+
+    Whole padded photos are recognized without detect-then-crop step of `ImageStationRecognitionService`,
+    so results are cached under engine version of their own.
+    """
+    engine_version = f'ocr-batch:{settings.OCR_ENGINE_VERSION}'
+
+    def __init__(self, files: list) -> None:
+        self.files = files
+
     def recognite(self) -> list:
-        reader = PyPDF2.PdfReader(self.file.temporary_file_path())
-        tickets = []
+        """
+        Recognite stations from every photo of batch.
 
-        for page in reader.pages:
-            ticket = self._get_ticket_info(page)
-            tickets.append(ticket)
+        :return: result of `ImageStationRecognitionService.extract_stations`
+                 or exception for each file, in the order of files.
+        """
+        services = [ImageStationRecognitionService(file) for file in self.files]
+        recognized = [RecognitionResultCache.get(service.digest, self.engine_version) for service in services]
 
-        return tickets
-    
-    def _get_ticket_info(self, page) -> dict:
-        """Get ticket info."""
-        text = page.extract_text()
-        text = text.replace(' ', '').lower()
+        images = {}
+        for index, result in enumerate(recognized):
+            if result is not RecognitionResultCache.MISS:
+                continue
+            try:
+                images[index] = ImagePreprocessingService(self.files[index]).load()
+            except OSError as error:
+                recognized[index] = error
+        if not images:
+            return recognized
 
-        self._validate_date(text)
+        results = OCREngineRegistry.readtext_batched(self.pad(list(images.values())), batch_size=len(images), detail=0)
+
+        for index, result in zip(images, results):
+            service = services[index]
+            try:
+                recognized[index] = service.extract_stations(result)
+            except ValidationError as error:
+                recognized[index] = error
+                continue
+            RecognitionResultCache.set(service.digest, self.engine_version, recognized[index])
+
+        return recognized
+
+    @staticmethod
+    def pad(images: list) -> list:
+        """
+        Pad grayscale images with white to the size of the biggest one, so they can be stacked in one batch.
+
+        Images are not resized, text keeps its proportions whatever the orientation of photo is.
+
+        :param images: list of grayscale images.
+        :return: list of images of equal size.
+        """
+        height = max(image.shape[0] for image in images)
+        width = max(image.shape[1] for image in images)
+
+        padded = []
+        for image in images:
+            canvas = numpy.full((height, width), 255, dtype=image.dtype)
+            canvas[:image.shape[0], :image.shape[1]] = image
+            padded.append(canvas)
+
+        return padded
+
+    @staticmethod
+    def claim_pending_tickets(limit: int, timeout: int) -> list:
+        """
+        Claim pending image tickets for batch.
+
+        Waits until `limit` tickets are claimed or `timeout` is expired.
+
+        :param limit: max count of tickets in batch.
+        :param timeout: max time to wait for tickets in milliseconds.
+        :return: list of claimed tickets.
+        """
+        poll_interval = 0.05
+        deadline = time.monotonic() + timeout / 1000
+        claimed = []
+
+        while len(claimed) < limit:
+            with transaction.atomic():
+                tickets = list(
+                    Ticket.objects.select_for_update(skip_locked=True, of=('self',))
+                    .filter(status=Ticket.Status.PENDING)
+                    .exclude(file__iendswith='.pdf')
+                    .order_by('created_at')[:limit - len(claimed)]
+                )
+                Ticket.objects.filter(id__in=[ticket.id for ticket in tickets]).update(status=Ticket.Status.PROCESSING)
+            claimed.extend(tickets)
+
+            if len(claimed) >= limit or time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+
+        return claimed
+
+
+class PDFTicketExtractor:
+    """
+    Precompiled single-pass extractor of ticket fields from text of PDF page.
+
+    Page text is normalised once and scanned once with alternation of every field label and date.
+    Fields are then sliced between label positions, so no pattern is searched twice.
+    """
+    TICKET_YEAR = '2023'
+    TICKET_NUMBER_MIN_LENGTH = 6
+    TICKET_NUMBER_MAX_LENGTH = 23
+
+    # Pairs of start and end labels of field, in order of priority.
+    ORIGIN_LABELS = (
+        ('відправлення', 'вагон'),
+        ('відправлення', 'поїзд'),
+        ('від/from', 'вагон/car'),
+    )
+    DESTINATION_LABELS = (
+        ('призначення', 'місце'),
+        ('призначення', 'вагон'),
+        ('до/to', 'місце/place'),
+    )
+    TICKET_NUMBER_LABELS = (
+        ('посадочнийдокументboardingdocument', 'пн'),
+        ('посадочнийдокументboardingdocument', 'фн'),
+        ('посадочнийдокументboardingdocument', 'зн'),
+        ('посадочнийдокументboardingdocument', 'фк'),
+        ('посадочнийдокумент', 'пн'),
+        ('посадочнийдокумент', 'зн'),
+        ('посадочнийдокумент', 'фк'),
+    )
+    TICKET_DATE_LABELS = (
+        ('цейпосадочнийдокументєпідставоюдляпроїзду', 'прізвище'),
+        ('цейпосадочнийдокументєпідставоюдляпроїздуthisboardingdocumentisthebasisforpassage', 'familyname'),
+    )
+    LABELS = sorted(
+        {label for labels in (ORIGIN_LABELS, DESTINATION_LABELS, TICKET_NUMBER_LABELS, TICKET_DATE_LABELS)
+         for pair in labels for label in pair},
+        key=len, reverse=True,
+    )
+    # Longer label also counts as every label it starts with, e.g. `вагон/car` ends both `вагон` and `вагон/car`.
+    LABEL_PREFIXES = {
+        label: [prefix for prefix in labels if label.startswith(prefix)] for labels in (LABELS,) for label in labels
+    }
+    DATE = 'date'
+    TOKEN_PATTERN = re.compile(r'(?P<date>\d{2}\.\d{2}\.\d{4})|(?P<label>' + '|'.join(map(re.escape, LABELS)) + ')')
+    # Station labels are followed by station code.
+    STATION_CODE_PATTERN = re.compile(r'\d{5,7}')
+    STATION_LABELS = {'відправлення', 'від/from', 'призначення', 'до/to'}
+    DIGITS_PATTERN = re.compile(r'\d')
+    WHITESPACE_TABLE = str.maketrans('', '', ' \n')
+
+    def extract(self, text: str) -> dict:
+        """
+        Extract ticket fields from text of PDF page.
+
+        :param text: text from pdf page.
+        :raises ValidationError: if any field is not found or ticket year is wrong.
+        :return: {
+            'origin': start,
+            'destination': finish,
+            'ticket_number': uniquer ticket number,
+            'ticket_date': ticket date,
+            'year': ticket year
+        }
+        """
+        text = self.normalise(text)
+        tokens = self.scan(text)
+
+        year = self._get_year(text, tokens)
+        ticket_date = self._get_field(self.TICKET_DATE_LABELS, text, tokens)
+        ticket_number = self._get_ticket_number(text, tokens)
+        if ticket_number is None:
+            raise ValidationError(detail='Ticket number not found', code=HTTP_400_BAD_REQUEST)
+
+        origin = self._get_field(self.ORIGIN_LABELS, text, tokens)
+        if origin is None:
+            raise ValidationError(detail='Origin not found', code=HTTP_400_BAD_REQUEST)
+
+        destination = self._get_field(self.DESTINATION_LABELS, text, tokens)
+        if destination is None:
+            raise ValidationError(detail='Destination not found', code=HTTP_400_BAD_REQUEST)
 
-        ticket_number = self.get_ticket_number(text)
-        
         return {
-            'origin': re.sub(r'\d', '', self._get_origin(text)),
-            'destination': re.sub(r'\d', '', self._get_destination(text)),
-            'ticket_number': ticket_number,
+            'origin': self.DIGITS_PATTERN.sub('', origin),
+            'destination': self.DIGITS_PATTERN.sub('', destination),
+            'ticket_number': f'{ticket_number}+{ticket_date}',
+            'ticket_date': ticket_date,
+            'year': year,
         }
 
-    def _get_origin(self, text: str) -> str:
+    def normalise(self, text: str) -> str:
         """
-        Get origin from text.
-        
-        :param text: text from pdf file.
-        :return: origin.
+        Remove spaces and line breaks from text and lower it.
+
+        :param text: text from pdf page.
+        :return: normalised text.
         """
-        text = text.replace('\n', '')
+        return text.translate(self.WHITESPACE_TABLE).lower()
 
-        patterns = [r'відправлення\d{5,7}(.*?)вагон', r'відправлення\d{5,7}(.*?)поїзд', r'від/from\d{5,7}(.*?)вагон/car']
-        match = self.__match_patterns(patterns, text)
+    def scan(self, text: str) -> dict:
+        """
+        Find positions of all labels and dates in one pass over text.
 
-        if match: return match
+        :param text: normalised text.
+        :return: label (or `DATE`) mapped to sorted list of (start, end) positions.
+        """
+        tokens = defaultdict(list)
 
-        raise ValidationError(detail='Origin not found', code=HTTP_400_BAD_REQUEST)
-    
-    def _get_destination(self, text: str) -> str:
+        for match in self.TOKEN_PATTERN.finditer(text):
+            start = match.start()
+            if match.lastgroup == self.DATE:
+                tokens[self.DATE].append((start, match.end()))
+                continue
+
+            for label in self.LABEL_PREFIXES[match.group()]:
+                tokens[label].append((start, start + len(label)))
+
+        return tokens
+
+    def _get_year(self, text: str, tokens: dict) -> str:
         """
-        Get destination from text.
-        
-        :param text: text from pdf file.
-        :return: origin.
+        Get year of first date in text.
+
+        :param text: normalised text.
+        :param tokens: result of `scan`.
+        :raises ValidationError: if date not found or year is not `TICKET_YEAR`.
+        :return: year.
         """
-        text = text.replace('\n', '')
+        if not tokens[self.DATE]:
+            raise ValidationError(detail='Date not found.', code=HTTP_400_BAD_REQUEST)
 
-        patterns = [r'призначення\d{5,7}(.*?)місце', r'призначення\d{5,7}(.*?)вагон', r'до/to\d{5,7}(.*?)місце/place']
-        match = self.__match_patterns(patterns, text)
+        start, end = tokens[self.DATE][0]
+        year = text[end - 4:end]
+        if year != self.TICKET_YEAR:
+            raise ValidationError(detail=f'Ticket year is not {self.TICKET_YEAR}.', code=HTTP_400_BAD_REQUEST)
 
-        if match: return match
-            
-        raise ValidationError(detail='Destination not found', code=HTTP_400_BAD_REQUEST)
-    
-    def get_ticket_number(self, text: str) -> str:
+        return year
+
+    def _get_ticket_number(self, text: str, tokens: dict) -> str or None:
         """
-        Find ticket number from string.
-        
-        :param text: text from pdf file.
-        :return: ticket number.
+        Get ticket number from text.
+
+        :param text: normalised text.
+        :param tokens: result of `scan`.
+        :return: ticket number or None.
         """
-        text = text.replace('\n', '')
+        for labels in self.TICKET_NUMBER_LABELS:
+            ticket_number = self._get_field((labels,), text, tokens)
 
-        patterns = [r'посадочнийдокументboardingdocument(.*?)пн', r'посадочнийдокументboardingdocument(.*?)фн',
-                    r'посадочнийдокументboardingdocument(.*?)зн', r'посадочнийдокументboardingdocument(.*?)фк',
-                    r'посадочнийдокумент(.*?)пн', r'посадочнийдокумент(.*?)пн',
-                    r'посадочнийдокумент(.*?)зн', r'посадочнийдокумент(.*?)фк',]
+            if ticket_number and len(ticket_number) >= self.TICKET_NUMBER_MIN_LENGTH:
+                return ticket_number[-self.TICKET_NUMBER_MAX_LENGTH:]
 
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+    def _get_field(self, labels: tuple, text: str, tokens: dict) -> str or None:
+        """
+        Get text between start label and the nearest end label after it, for the first matched pair of labels.
 
-            if match and len(match.group(1)) > 5:
-                grouped_match = match.group(1)
+        :param labels: pairs of start and end labels, in order of priority.
+        :param text: normalised text.
+        :param tokens: result of `scan`.
+        :return: field value or None.
+        """
+        for start_label, end_label in labels:
+            ends = tokens[end_label]
 
-                if len(grouped_match) > 23:
-                    grouped_match = grouped_match[-23:]
+            for _, value_start in tokens[start_label]:
+                if start_label in self.STATION_LABELS:
+                    code = self.STATION_CODE_PATTERN.match(text, value_start)
+                    if not code:
+                        continue
+                    value_start = code.end()
 
-                return f"{grouped_match.lower().replace(' ',  '')}+{self.__get_ticket_date(text)}"
+                index = bisect_left(ends, (value_start, value_start))
+                if index < len(ends):
+                    return text[value_start:ends[index][0]]
 
-        raise ValidationError(detail='Ticket number not found', code=HTTP_400_BAD_REQUEST)
-    
-    @staticmethod
-    def __get_ticket_date(text: str) -> str or None:
+        return None
+
+
+class PDFStationRecognitionService(StationRecognitionService):
+    """Service to recognite station from PDF file."""
+    extractor = PDFTicketExtractor()
+    engine_version = f'pdf:{settings.PDF_ENGINE_VERSION}'
+
+    def iter_tickets(self):
         """
-        Find ticket date from string.
-        
-        :param text: text from pdf file.
-        :return: ticket date.
+        Recognite tickets page by page.
+
+        Pages are loaded lazily, so every ticket is available as soon as its page is parsed.
+        Result is cached once all pages are parsed.
+
+        :return: generator of ticket info for every page.
         """
-        patterns = [r'цейпосадочнийдокументєпідставоюдляпроїзду(.*?)прізвище',
-                    r'цейпосадочнийдокументєпідставоюдляпроїздуthisboardingdocumentisthebasisforpassage(.*?)familyname']
+        result = RecognitionResultCache.get(self.digest, self.engine_version)
+        if result is not RecognitionResultCache.MISS:
+            yield from result
+            return
 
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
+        result = []
+        for page in self.reader.pages:
+            ticket = self._get_ticket_info(page)
+            result.append(ticket)
+            yield ticket
 
-            if match:
-                return match.group(1).lower().replace(' ',  '')
+        RecognitionResultCache.set(self.digest, self.engine_version, result)
 
-    @staticmethod
-    def __match_patterns(patterns: list, text: str) -> str or None:
-        """Match of patterns to text."""
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            
-            if match:
-                return match.group(1).lower().replace(' ',  '')
+    @cached_property
+    def reader(self) -> PyPDF2.PdfReader:
+        """PDF reader of file."""
+        if isinstance(self.file, TemporaryUploadedFile):
+            return PyPDF2.PdfReader(self.file.temporary_file_path())
 
-    @staticmethod
-    def _validate_date(text: str):
-        """Check if the current year is 2023."""
-        pattern = r'\d{2}\.\d{2}\.\d{4}'
-        matches = re.findall(pattern, text)
-
-        if matches:
-            date = matches[0][-4:]
-            if date != '2023':
-                raise ValidationError(detail='Ticket year is not 2023.', code=HTTP_400_BAD_REQUEST)
-        else:
-            raise ValidationError(detail='Date not found.', code=HTTP_400_BAD_REQUEST)
+        return PyPDF2.PdfReader(self.file.path)
+
+    @property
+    def pages_count(self) -> int:
+        """Count of pages in file."""
+        return len(self.reader.pages)
+
+    def _get_ticket_info(self, page) -> dict:
+        """Get ticket info."""
+        ticket = self.extractor.extract(page.extract_text())
+
+        return {
+            'origin': ticket['origin'],
+            'destination': ticket['destination'],
+            'ticket_number': ticket['ticket_number'],
+        }
@@ -0,0 +1,40 @@
+"""Signals for coupons app."""
+from collections import Counter
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Coupon
+from .services import CouponInventoryService
+
+
+@receiver(pre_save, sender=Coupon)
+def remember_coupon_tier(sender, instance: Coupon, **kwargs) -> None:
+    """Remember stored tier and owner of coupon, so inventory can be adjusted once coupon is saved."""
+    instance._stored_tier = None
+    if instance.pk:
+        instance._stored_tier = Coupon.objects.filter(pk=instance.pk).values_list('user_id', 'distance', 'price').first()
+
+
+@receiver(post_save, sender=Coupon)
+def count_saved_coupon(sender, instance: Coupon, **kwargs) -> None:
+    """Count created coupon and coupon which was assigned, unassigned or moved to other tier in inventory."""
+    tiers = Counter()
+
+    stored_tier = getattr(instance, '_stored_tier', None)
+    if stored_tier:
+        user_id, distance, price = stored_tier
+        if user_id is None:
+            tiers[(distance, price)] -= 1
+
+    if instance.user_id is None:
+        tiers[(instance.distance, instance.price)] += 1
+
+    CouponInventoryService.adjust(tiers)
+
+
+@receiver(post_delete, sender=Coupon)
+def count_deleted_coupon(sender, instance: Coupon, **kwargs) -> None:
+    """Remove deleted available coupon from inventory."""
+    if instance.user_id is None:
+        CouponInventoryService.adjust({(instance.distance, instance.price): -1})
@@ -1,42 +1,391 @@
+import logging
+from datetime import timedelta
+from random import randint
+
+from celery import chain
+from celery.exceptions import Ignore
+from celery.signals import worker_process_init
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.utils import IntegrityError, OperationalError
+from django.utils import timezone
+from googlemaps.exceptions import Timeout, TransportError
+from PIL import UnidentifiedImageError
 from rest_framework.exceptions import ValidationError
+from rest_framework.status import HTTP_400_BAD_REQUEST
 
 from bolt_uz.celery import app
 
-from .models import Ticket
-from .services import CalculateDistanceService, ImageStationRecognitionService
+from .enums import DistanceErrors
+from .models import CouponImportJob, Ticket
+from .services import (CouponImportJobService, CouponInventoryService,
+                       DistanceResolver, ImageBatchStationRecognitionService,
+                       ImageStationRecognitionService, OCREngineRegistry,
+                       PDFStationRecognitionService, RecognitionResultCache,
+                       TicketScheduler)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_BATCH_RECOGNITION_KEY = 'image-batch-recognition'
+# Seconds a queued ticket is given to reach scheduler queue before it is restored.
+TICKET_RESTORE_DELAY = 60
+
+
+class TicketStageTask(app.Task):
+    """Stage of ticket recognition, ticket is failed and released once the stage fails for good."""
+    def on_failure(self, exc, task_id, args, kwargs, einfo) -> None:
+        ticket_id = kwargs.get('ticket_id', args[0] if args else None)
+        ticket = Ticket.objects.filter(id=ticket_id).exclude(
+            status__in=[Ticket.Status.DONE, Ticket.Status.FAILED]
+        ).first()
+
+        if ticket:
+            fail_ticket(ticket, exc)
+
+
+@worker_process_init.connect
+def warm_ocr_engines(**kwargs) -> None:
+    """Load OCR readers once per worker process."""
+    OCREngineRegistry.load()
 
 
-# TODO: create better solution for image station recognition.
 @app.task
-def image_station_recognition(ticket_id: int) -> None:
-    """Recognite image."""
+def dispatch_tickets(restore: bool = False) -> int:
+    """
+    Start recognition of queued tickets picked by fair-share scheduler.
+
+    :param restore: put queued tickets lost by Redis back to scheduler queues first.
+    :return: count of started tickets.
+    """
+    if restore:
+        restored = TicketScheduler.restore(
+            Ticket.objects.filter(
+                status=Ticket.Status.QUEUED,
+                created_at__lt=timezone.now() - timedelta(seconds=TICKET_RESTORE_DELAY),
+            ).order_by('created_at')
+        )
+        if restored:
+            logger.warning('%s queued tickets were missing in scheduler and were restored.', restored)
+
+    ticket_ids = TicketScheduler.next_tickets()
+    tickets = list(Ticket.objects.filter(id__in=ticket_ids))
+    TicketScheduler.discard(list(set(ticket_ids) - {ticket.id for ticket in tickets}))
+
+    started = 0
+    for ticket in tickets:
+        # Ticket may be queued twice after restore, only the first pick starts it.
+        if not Ticket.objects.filter(id=ticket.id, status=Ticket.Status.QUEUED).update(status=Ticket.Status.PENDING):
+            if ticket.status in (Ticket.Status.DONE, Ticket.Status.FAILED):
+                TicketScheduler.release(ticket)
+            continue
+
+        try:
+            if ticket.file.name.lower().endswith('.pdf'):
+                pdf_station_recognition.si(ticket.id).apply_async()
+            elif settings.OCR_BATCH_MODE:
+                schedule_image_batch_recognition()
+            else:
+                image_station_recognition(ticket.id).apply_async()
+        except Exception:
+            # Ticket goes back to queue with the next restore.
+            logger.exception('Recognition of ticket %s was not started.', ticket.id)
+            Ticket.objects.filter(id=ticket.id).update(status=Ticket.Status.QUEUED)
+            TicketScheduler.discard([ticket.id])
+            continue
+
+        started += 1
+
+    return started
+
+
+def release_ticket(ticket: Ticket) -> None:
+    """
+    Free scheduler slots of processed ticket and start next queued tickets.
+
+    :param ticket: done or failed ticket.
+    :return: None.
+    """
+    TicketScheduler.release(ticket)
+    dispatch_tickets.apply_async()
+
+
+def image_station_recognition(ticket_id: int) -> chain:
+    """
+    Build pipeline of photo ticket recognition.
+
+    Every stage saves its result to ticket and is skipped if result is already saved,
+    so a retried downstream stage never runs OCR again.
+
+    :param ticket_id: id of ticket.
+    :return: chain of stages.
+    """
+    return chain(
+        read_ticket_words.si(ticket_id),
+        extract_ticket_stations.si(ticket_id),
+        resolve_ticket_distances.si(ticket_id),
+        credit_ticket_distances.si(ticket_id),
+    )
+
+
+@app.task(base=TicketStageTask, autoretry_for=(OSError,), retry_backoff=True, max_retries=2)
+def read_ticket_words(ticket_id: int) -> None:
+    """Recognize words from photo of ticket, unless stations of the same file are already recognized."""
     ticket = Ticket.objects.get(id=ticket_id)
-    file = ticket.file
-    user = ticket.user
-    
-    print(type(file))
+    if ticket.words is not None or ticket.stations is not None:
+        return None
 
-    station_recognition_service = ImageStationRecognitionService(file)
+    station_recognition_service = ImageStationRecognitionService(ticket.file, ticket.digest)
+    stations = RecognitionResultCache.get(station_recognition_service.digest, station_recognition_service.engine_version)
+    if stations is not RecognitionResultCache.MISS:
+        ticket.stations = stations
+    else:
+        try:
+            ticket.words = station_recognition_service.read_words()
+        except (UnidentifiedImageError, FileNotFoundError) as error:
+            # Broken or missing photo fails the same way on every retry.
+            fail_ticket(ticket, error)
+            raise Ignore()
+
+    ticket.status = Ticket.Status.PROCESSING
+    ticket.save(update_fields=['words', 'stations', 'status'])
+
+
+@app.task(base=TicketStageTask, autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def extract_ticket_stations(ticket_id: int) -> None:
+    """Extract origin, destination and ticket number from recognized words."""
+    ticket = Ticket.objects.get(id=ticket_id)
+    if ticket.stations is not None:
+        return None
+
+    station_recognition_service = ImageStationRecognitionService(ticket.file, ticket.digest)
     try:
-        result = station_recognition_service.recognite()
-    except ValidationError:
-        ticket.delete()
+        stations = station_recognition_service.extract_stations(ticket.words)
+    except ValidationError as error:
+        fail_ticket(ticket, error)
+        raise Ignore()
+
+    RecognitionResultCache.set(station_recognition_service.digest, station_recognition_service.engine_version, stations)
+    ticket.stations = stations
+    ticket.save(update_fields=['stations'])
+
+
+@app.task(base=TicketStageTask, autoretry_for=(TransportError, Timeout), retry_backoff=True, retry_backoff_max=600,
+          max_retries=8)
+def resolve_ticket_distances(ticket_id: int) -> None:
+    """Resolve distance of every recognized pair of stations."""
+    ticket = Ticket.objects.get(id=ticket_id)
+    if all('distance' in station for station in ticket.stations):
         return None
 
+    pairs = [(station.get('origin').lower(), station.get('destination').lower()) for station in ticket.stations]
+    with DistanceResolver() as resolver:
+        distances = resolver.resolve(pairs)
+
+    stations = []
+    for station, pair in zip(ticket.stations, pairs):
+        distance = distances[pair]
+        if distance is None:
+            distance = ValidationError(detail=DistanceErrors.ROUTE_NOT_FOUND.value, code=HTTP_400_BAD_REQUEST)
+        if isinstance(distance, ValidationError):
+            fail_ticket(ticket, distance)
+            raise Ignore()
+
+        stations.append({**station, 'origin': pair[0], 'destination': pair[1], 'distance': distance})
+
+    ticket.stations = stations
+    ticket.save(update_fields=['stations'])
+
+
+@app.task(base=TicketStageTask, autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def credit_ticket_distances(ticket_id: int) -> None:
+    """Credit resolved distances of ticket to user."""
+    with transaction.atomic():
+        ticket = Ticket.objects.select_for_update(of=('self',)).select_related('user').get(id=ticket_id)
+        if ticket.status == Ticket.Status.DONE:
+            return None
 
-    distance = 0
-    for data in result:
-        origin = data.get('origin').lower()
-        destination = data.get('destination').lower()
+        for station in ticket.stations:
+            ticket.origin = station['origin']
+            ticket.destination = station['destination']
+            ticket.user.update_distance(station['distance'], ticket=ticket)
 
+        ticket.status = Ticket.Status.DONE
+        ticket.save(update_fields=['origin', 'destination', 'status'])
+
+    release_ticket(ticket)
+
+
+def schedule_image_batch_recognition() -> None:
+    """Start batch recognition unless it is already running, so only one task waits for a batch to be filled."""
+    if cache.add(IMAGE_BATCH_RECOGNITION_KEY, True, timeout=settings.OCR_BATCH_LEASE):
+        image_batch_recognition.apply_async()
+
+
+@app.task
+def image_batch_recognition() -> None:
+    """
+    Recognite pending image tickets in OCR batches while there are any, then resolve and credit every ticket separately.
+
+    Only one batch task runs at once (see `schedule_image_batch_recognition`).
+    """
+    try:
+        while True:
+            tickets = ImageBatchStationRecognitionService.claim_pending_tickets(
+                settings.OCR_BATCH_SIZE, settings.OCR_BATCH_TIMEOUT_MS
+            )
+            if not tickets:
+                break
+
+            try:
+                results = ImageBatchStationRecognitionService([ticket.file for ticket in tickets]).recognite()
+            except Exception as error:
+                logger.exception('Batch recognition of tickets %s failed.', [ticket.id for ticket in tickets])
+                results = [error] * len(tickets)
+
+            for ticket, result in zip(tickets, results):
+                if isinstance(result, Exception):
+                    fail_ticket(ticket, result)
+                    continue
+
+                try:
+                    ticket.stations = result
+                    ticket.save(update_fields=['stations'])
+                    chain(resolve_ticket_distances.si(ticket.id), credit_ticket_distances.si(ticket.id)).apply_async()
+                except Exception as error:
+                    logger.exception('Resolving distances of ticket %s was not started.', ticket.id)
+                    fail_ticket(ticket, error)
+    finally:
+        cache.delete(IMAGE_BATCH_RECOGNITION_KEY)
+
+    # Tickets made pending after the last claim, but before the lease was released, would wait for the next dispatch.
+    if Ticket.objects.filter(status=Ticket.Status.PENDING).exclude(file__iendswith='.pdf').exists():
+        schedule_image_batch_recognition()
+
+
+@app.task(base=TicketStageTask, bind=True, max_retries=8)
+def pdf_station_recognition(self, ticket_id: int) -> None:
+    """
+    Recognite PDF tickets page by page.
+
+    Distances of all pages are resolved concurrently while pages are parsed,
+    every page is credited to user in its own transaction.
+    Temporary google maps errors are retried from the first page which is not credited yet,
+    ticket is marked as failed and released on any other error.
+    """
+    ticket = Ticket.objects.select_related('user').get(id=ticket_id)
+
+    try:
+        error = credit_pdf_pages(ticket)
+    except (TransportError, Timeout) as temporary_error:
+        if self.request.retries < self.max_retries:
+            raise self.retry(
+                exc=temporary_error,
+                countdown=get_exponential_backoff_interval(factor=1, retries=self.request.retries, maximum=600),
+            )
+        error = temporary_error
+    except Exception as unexpected_error:
+        logger.exception('Recognition of PDF ticket %s failed.', ticket.id)
+        error = unexpected_error
+
+    try:
+        if error:
+            ticket.status = Ticket.Status.FAILED
+            ticket.error = str(
+                error.detail[0] if isinstance(error, ValidationError) else error
+            )[:Ticket.MAX_LENGTH['ERROR']]
+            if not ticket.pages_processed:
+                ticket.unique_number = None
+            ticket.save(update_fields=['status', 'error', 'unique_number'])
+        else:
+            ticket.status = Ticket.Status.DONE
+            ticket.save(update_fields=['status'])
+    finally:
+        release_ticket(ticket)
+
+
+def credit_pdf_pages(ticket: Ticket) -> Exception or None:
+    """
+    Recognite pages of PDF ticket and credit distance of every page to user.
+
+    Pages credited by previous attempt are skipped.
+
+    :param ticket: placeholder ticket of uploaded file.
+    :return: error which stopped processing of pages or None.
+    """
+    user = ticket.user
+
+    station_recognition_service = PDFStationRecognitionService(ticket.file, ticket.digest)
+    ticket.status = Ticket.Status.PROCESSING
+    ticket.pages_count = station_recognition_service.pages_count
+    ticket.save(update_fields=['status', 'pages_count'])
+
+    pages = []
+    error = None
+    with DistanceResolver() as resolver:
         try:
-            ticket_distance = CalculateDistanceService().calculate_distance(origin, destination)
-            distance += ticket_distance
-        except ValidationError:
-            ticket.delete()
-        
-        ticket.origin = origin
-        ticket.destination = destination
-        ticket.save()
-
-        user.update_distance(ticket_distance)
+            for index, data in enumerate(station_recognition_service.iter_tickets()):
+                if index < ticket.pages_processed:
+                    continue
+                origin = data.get('origin').lower()
+                destination = data.get('destination').lower()
+                pages.append(
+                    (index, origin, destination, data.get('ticket_number'), resolver.submit(origin, destination))
+                )
+        except ValidationError as extraction_error:
+            error = extraction_error
+
+        try:
+            for index, origin, destination, number, distance_future in pages:
+                ticket_distance = distance_future.result()
+                if ticket_distance is None:
+                    raise ValidationError(detail=DistanceErrors.ROUTE_NOT_FOUND.value, code=HTTP_400_BAD_REQUEST)
+
+                with transaction.atomic():
+                    if index == 0:
+                        page_ticket = station_recognition_service.save_ticket(origin, destination, number, user, ticket)
+                    else:
+                        page_ticket = station_recognition_service.save_ticket(
+                            origin, destination, f'{number}+{randint(10000000, 90000000)}', user
+                        )
+                    user.update_distance(ticket_distance, ticket=page_ticket)
+
+                    ticket.pages_processed = index + 1
+                    ticket.save(update_fields=['pages_processed'])
+        except (ValidationError, IntegrityError) as credit_error:
+            error = credit_error
+
+    return error
+
+
+@app.task
+def purge_expired_coupons() -> int:
+    """Delete expired coupons which were never assigned to user and rebuild inventory counters."""
+    deleted = CouponInventoryService.purge_expired()
+    CouponInventoryService.recount()
+
+    return deleted
+
+
+@app.task
+def import_coupons(job_id: int) -> None:
+    """Import coupons from file of import job."""
+    CouponImportJobService(CouponImportJob.objects.get(id=job_id)).run()
+
+
+def fail_ticket(ticket: Ticket, error: Exception) -> None:
+    """
+    Mark ticket as failed, so the same ticket can be uploaded again.
+
+    :param ticket: ticket.
+    :param error: reason of failure.
+    :return: None.
+    """
+    ticket.status = Ticket.Status.FAILED
+    ticket.error = str(error.detail[0] if isinstance(error, ValidationError) else error)[:Ticket.MAX_LENGTH['ERROR']]
+    ticket.unique_number = None
+    try:
+        ticket.save(update_fields=['status', 'error', 'unique_number'])
+    finally:
+        release_ticket(ticket)
@@ -1,9 +1,7 @@
 """Views for coupons app."""
-from random import randint
-
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.db.utils import IntegrityError
 from django.http import HttpRequest, HttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.mixins import DestroyModelMixin, RetrieveModelMixin
@@ -15,12 +13,12 @@ from rest_framework.viewsets import GenericViewSet
 from .constants import IMAGE_EXTENTSIONS
 from .models import Coupon, Ticket
 from .serializers import (CouponSerializer, TicketSerializer,
-                          TickeUploadFiletSerializer)
-from .services import (CalculateDistanceService, CouponService,
-                       PDFStationRecognitionService)
-from .tasks import image_station_recognition
-from .utils import (convert_to_temporary_uploaded_file,
-                    deepcopy_temporary_uploaded_file, has_image_extension)
+                          TicketStatusSerializer, TickeUploadFiletSerializer)
+from .services import (CouponInventoryService, CouponService,
+                       RouteDistanceCache, TicketFileStorageService,
+                       TicketFingerprintService, TicketScheduler)
+from .tasks import dispatch_tickets
+from .utils import has_image_extension
 
 
 class CouponViewSet(DestroyModelMixin, GenericViewSet):
@@ -33,18 +31,34 @@ class CouponViewSet(DestroyModelMixin, GenericViewSet):
     def get(self, request: HttpRequest, pk=None) -> HttpResponse:
         """
         Retrieve coupon by user distance.
+
+        With `?all=true` user distance is redeemed with as many coupons as possible.
         
         :param request: http request.
         :return: response.
         """
         user = request.user
+        if request.query_params.get('all') == 'true':
+            coupons = CouponService().get_coupons_by_distance(user)
+            serializer = self.serializer_class(coupons, many=True)
+
+            return Response(serializer.data)
+
         coupon = CouponService().get_coupon_by_distance(user)
         serializer = self.serializer_class(coupon)
 
-        user.update_distance(-coupon.distance)
-
         return Response(serializer.data)
 
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def inventory(self, request: HttpRequest) -> HttpResponse:
+        """
+        Retrieve available coupons count of every tier.
+
+        :param request: http request.
+        :return: response.
+        """
+        return Response(CouponInventoryService.get_inventory())
+
 
 class TicketViewSet(RetrieveModelMixin, GenericViewSet):
     """Viewset to upload ticket."""
@@ -65,39 +79,47 @@ class TicketViewSet(RetrieveModelMixin, GenericViewSet):
         user = request.user
 
         file = serializer.validated_data.get('file')
-        if isinstance(file, InMemoryUploadedFile):
-            file = convert_to_temporary_uploaded_file(file)
-
-        if '.pdf' in file.name:
-            station_recognition_service = PDFStationRecognitionService(file)
-        elif has_image_extension(file.name):
-            try:
-                ticket = Ticket.objects.create(file=file, unique_number=file.name, user=user)
-            except IntegrityError:
-                raise ValidationError(detail="Ticket already uploaded.", code=HTTP_400_BAD_REQUEST)
-            image_station_recognition.apply_async(kwargs={"ticket_id": ticket.id})
-
-            return Response(data={'id': ticket.id})
-        else:
+
+        if '.pdf' not in file.name and not has_image_extension(file.name):
             raise ValidationError(detail=f'File format is not supported. Use {", ".join(IMAGE_EXTENTSIONS)} or .pdf.', code=HTTP_400_BAD_REQUEST)
 
-        result = station_recognition_service.recognite()
+        TicketScheduler.check_quota(user.id)
+
+        fingerprint = TicketFingerprintService(file, user)
+        if fingerprint.is_duplicate() or Ticket.objects.filter(unique_number=file.name).exists():
+            raise ValidationError(detail="Ticket already uploaded.", code=HTTP_400_BAD_REQUEST)
 
-        distance = 0
-        already_saved = False
-        for data in result:
-            origin = data.get('origin').lower()
-            destination = data.get('destination').lower()
+        file_name = TicketFileStorageService().store(file, digest=fingerprint.digest)
+        try:
+            ticket = Ticket.objects.create(file=file_name, unique_number=file.name, user=user, digest=fingerprint.digest,
+                                           perceptual_hash=fingerprint.perceptual_hash, status=Ticket.Status.QUEUED)
+        except IntegrityError:
+            raise ValidationError(detail="Ticket already uploaded.", code=HTTP_400_BAD_REQUEST)
 
-            ticket_distance = CalculateDistanceService().calculate_distance(origin, destination)
-            distance += ticket_distance
+        TicketScheduler.submit(ticket)
+        dispatch_tickets.apply_async()
 
-            station_recognition_service.file = deepcopy_temporary_uploaded_file(file)
-            if not already_saved:
-                station_recognition_service.save_ticket(origin, destination, data.get('ticket_number'), user)
-                already_saved = True
-            else:
-                station_recognition_service.save_ticket(origin, destination, f'{data.get("ticket_number")}+{randint(10000000, 90000000)}', user)
-            user.update_distance(ticket_distance)
+        return Response(data={'id': ticket.id})
 
-        return Response(data={'distance': distance})
+    @action(detail=True, methods=['GET'])
+    def status(self, request: HttpRequest, pk=None) -> HttpResponse:
+        """
+        Retrieve recognition status of uploaded ticket.
+
+        :param request: http request.
+        :return: http response.
+        """
+        ticket = get_object_or_404(Ticket, pk=pk, user=request.user)
+        serializer = TicketStatusSerializer(ticket)
+
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAdminUser])
+    def distance_cache(self, request: HttpRequest) -> HttpResponse:
+        """
+        Retrieve hit and miss counters of route distance cache.
+
+        :param request: http request.
+        :return: response.
+        """
+        return Response(RouteDistanceCache.get_stats())
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from user_auth.models import BoltUser, DistanceLedgerEntry
+
+
+class Command(BaseCommand):
+    help = 'Rebuild user distances from the distance ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only show users with wrong distance')
+
+    def handle(self, *args, **options):
+        users = BoltUser.objects.annotate(ledger_distance=Coalesce(Sum('distance_ledger__distance'), 0))
+        candidates = [user.id for user in users.iterator() if user.distance != user.ledger_distance]
+        fixed = 0
+
+        for user_id in candidates:
+            # User row is locked before ledger is summed, so credits and debits running meanwhile
+            # are either counted by the sum or applied on top of the fixed distance.
+            with transaction.atomic():
+                user = BoltUser.objects.select_for_update().get(id=user_id)
+                ledger_distance = DistanceLedgerEntry.objects.filter(user_id=user_id).aggregate(
+                    total=Coalesce(Sum('distance'), 0)
+                )['total']
+                if user.distance == ledger_distance:
+                    continue
+
+                self.stdout.write(f'{user.email}: {user.distance} -> {ledger_distance}')
+                if not options['dry_run']:
+                    BoltUser.objects.filter(id=user_id).update(distance=ledger_distance)
+                fixed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Users with wrong distance: {fixed}'))
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.19 on 2026-10-18 14:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_balances(apps, schema_editor):
+    BoltUser = apps.get_model('user_auth', 'BoltUser')
+    DistanceLedgerEntry = apps.get_model('user_auth', 'DistanceLedgerEntry')
+
+    DistanceLedgerEntry.objects.bulk_create(
+        DistanceLedgerEntry(user_id=user_id, distance=distance)
+        for user_id, distance in BoltUser.objects.exclude(distance=0).values_list('id', 'distance').iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coupons', '0007_couponimportjob'),
+        ('user_auth', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistanceLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.IntegerField(verbose_name='distance')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('coupon', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='coupons.coupon')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='coupons.ticket')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='distance_ledger', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 """Models for auth app."""
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 
 
 class BoltUser(AbstractUser):
@@ -19,12 +20,29 @@ class BoltUser(AbstractUser):
         """String representation of user instance."""
         return f'{self.first_name} {self.last_name}'
     
-    def update_distance(self, distance: str):
+    def update_distance(self, distance: int, ticket=None, coupon=None) -> None:
         """
         Update user distance.
+
+        Change is written to the ledger and applied with atomic update of distance column only.
         
-        :param distance: coupon distance.
+        :param distance: credited (positive) or debited (negative) distance.
+        :param ticket: ticket which is credited.
+        :param coupon: coupon which is paid with distance.
         :return: None.
         """
-        self.distance = self.distance + distance
-        self.save()
+        with transaction.atomic():
+            DistanceLedgerEntry.objects.create(user=self, distance=distance, ticket=ticket, coupon=coupon)
+            BoltUser.objects.filter(id=self.id).update(distance=F('distance') + distance)
+
+
+class DistanceLedgerEntry(models.Model):
+    """Describe credit or debit of user distance."""
+    user = models.ForeignKey(BoltUser, on_delete=models.CASCADE, related_name='distance_ledger')
+    distance = models.IntegerField(verbose_name='distance')
+    ticket = models.ForeignKey('coupons.Ticket', on_delete=models.SET_NULL, null=True, blank=True)
+    coupon = models.ForeignKey('coupons.Coupon', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'{self.user} {self.distance:+} at {self.created_at}'